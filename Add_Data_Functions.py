@@ -1,11 +1,16 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
 import time
-import matplotlib.dates as mdates
 import glob
+import os
+import sys
+import hashlib
+import functools
+import inspect
+import json
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-import matplotlib.ticker as mticker
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -22,915 +27,1690 @@ Last update 04 June 2024
 """
 
 
-# Read sites from a formatted file
+READ_CHUNK_ROWS = 100000 # rows per chunk when the readers stream through a file
+
+## Instrumentation (opt-in)
+# Public functions are decorated with @instrumented. While profiling is off the wrapper only checks
+# one global and calls the function. Inside `with profiling('run.jsonl') as prof:` every call
+# (and every profile_stage(name) block) records wall time, self time (without instrumented calls
+# inside it), rows in (DataFrame/Series/array arguments), rows out and, with memory = True, the peak
+# memory above the memory at the start of the call (tracemalloc, which slows the run down).
+# Records go to a JSON lines file and prof.summary() gives one row per function.
+# Calls made in worker processes (workers/jobs > 1) are not recorded.
+
+_PROFILE = None
+
+
+def instrumented(func):
+
+    name = func.__module__ + '.' + func.__qualname__
+
+    if inspect.isgeneratorfunction(func):
+        # time from the first batch to the last one, rows out counted over all batches
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILE is None:
+                return func(*args, **kwargs)
+            return _PROFILE.generator(name, func, args, kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILE is None:
+                return func(*args, **kwargs)
+            return _PROFILE.call(name, func, args, kwargs)
+
+    return wrapper
+
+
+class Profile:
+
+    def __init__(self, path = None, memory = True):
+
+        self.path = path
+        self.memory = memory
+        self.records = []
+        self._stack = [] # open calls: [start time, start memory, peak memory, seconds in instrumented calls]
+        self._file = open(path, 'a') if path is not None else None
+
+    # the record is written also when the call raises, with the exception in 'error'
+    def call(self, name, func, args, kwargs):
+
+        self._enter()
+        result, error = None, None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except BaseException as exc:
+            error = _error(exc)
+            raise
+        finally:
+            self._exit(name, _rows(args) + _rows(kwargs), _rows(result), error)
+            self._write(self.records[-1])
+
+    def generator(self, name, func, args, kwargs):
+
+        totals = {'seconds': 0.0, 'self_seconds': 0.0, 'rows_out': 0, 'peak_mb': None}
+        iterator = func(*args, **kwargs)
+        while True:
+            self._enter()
+            try:
+                item = next(iterator)
+                done = False
+            except StopIteration:
+                done = True
+            except BaseException as exc:
+                self._exit(name, 0, 0, _error(exc))
+                self._write(self.records[-1])
+                raise
+            self._exit(name, 0, 0 if done else _rows(item))
+
+            # one record for the whole iteration
+            batch = self.records.pop()
+            totals['seconds'] += batch['seconds']
+            totals['self_seconds'] += batch['self_seconds']
+            totals['rows_out'] += batch['rows_out']
+            if batch['peak_mb'] is not None:
+                totals['peak_mb'] = max(totals['peak_mb'] or 0, batch['peak_mb'])
+            if done:
+                self.records.append(dict(batch, rows_in = _rows(args) + _rows(kwargs), **totals))
+                self._write(self.records[-1])
+                return
+            yield item
+
+    def stage(self, name):
+        return _ProfileStage(self, name)
+
+    def _enter(self):
+
+        memory = 0
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+            tracemalloc.reset_peak()
+            memory = current
+        self._stack.append([time.perf_counter(), memory, memory, 0.0])
+
+    def _exit(self, name, rows_in, rows_out, error = None):
+
+        start, memory, peak, children = self._stack.pop()
+        seconds = time.perf_counter() - start
+        if self.memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if self._stack:
+            self._stack[-1][3] += seconds
+            self._stack[-1][2] = max(self._stack[-1][2], peak)
+
+        self.records.append({'function': name, 'depth': len(self._stack), 'seconds': seconds,
+                             'self_seconds': seconds - children, 'rows_in': rows_in, 'rows_out': rows_out,
+                             'peak_mb': (peak - memory) / 2**20 if self.memory else None, 'error': error})
+
+    def _write(self, record):
+
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+
+    def close(self):
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # one row per function: calls, total/self/max seconds, rows in/out and largest peak (MB), slowest first
+    def summary(self):
+
+        if not self.records:
+            return pd.DataFrame(columns = ['CALLS','TOTAL (s)','SELF (s)','MAX (s)','ROWS IN','ROWS OUT','PEAK (MB)'])
+        records = pd.DataFrame(self.records)
+        grouped = records.groupby('function')
+        summary = pd.DataFrame({'CALLS': grouped.size(),
+                                'TOTAL (s)': grouped['seconds'].sum(),
+                                'SELF (s)': grouped['self_seconds'].sum(),
+                                'MAX (s)': grouped['seconds'].max(),
+                                'ROWS IN': grouped['rows_in'].sum(),
+                                'ROWS OUT': grouped['rows_out'].sum(),
+                                'PEAK (MB)': grouped['peak_mb'].max()})
+        return summary.sort_values('SELF (s)', ascending = False).round(4)
+
+
+class _ProfileStage:
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        if self.profile is not None:
+            self.profile._enter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.profile._exit(self.name, 0, 0, None if exc[1] is None else _error(exc[1]))
+            self.profile._write(self.profile.records[-1])
+
+
+# 'error' of a profile record: exception type and message
+def _error(exc):
+
+    return '%s: %s' % (type(exc).__name__, exc)
+
+
+# a named block inside a function (e.g. the csv parsing of a reader), recorded like a call
+def profile_stage(name):
+
+    return _ProfileStage(_PROFILE, name)
+
+
+def enable_profiling(path = None, memory = True):
+
+    global _PROFILE
+    disable_profiling()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _PROFILE = Profile(path, memory)
+    return _PROFILE
+
 
-def read_trace_gas(path_and_filename, header,year,gas):
+def disable_profiling():
 
-    df = pd.read_csv(path_and_filename, comment = "#", names=header)
-    df = df.rename({'Date': 'datetime_utc'}, axis='columns')    
-    df.index = pd.to_datetime(df['datetime_utc']); del df['datetime_utc']; del df['time']
-    df.loc[df[gas] == -9999] = np.nan #replace -9999 by NAN
-    df = df.loc[(df.index.year == year)]
+    global _PROFILE
+    profile, _PROFILE = _PROFILE, None
+    if profile is not None:
+        profile.close()
+        if profile.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    return profile
+
+
+class profiling:
+
+    def __init__(self, path = None, memory = True):
+        self.path = path
+        self.memory = memory
+
+    def __enter__(self):
+        return enable_profiling(self.path, self.memory)
+
+    def __exit__(self, *exc):
+        disable_profiling()
+
+
+# rows of the data arguments/results: DataFrame, Series, Index, arrays, and lists, tuples or dicts of them
+def _rows(value):
+
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index, pd.Categorical)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.shape[0] if value.ndim else 0
+    if isinstance(value, (list, tuple)):
+        return sum(_rows(v) for v in value)
+    if isinstance(value, dict):
+        # a batch of iter_trace_gas is one set of rows
+        if value and all(isinstance(v, np.ndarray) for v in value.values()):
+            return len(next(iter(value.values())))
+        return sum(_rows(v) for v in value.values())
+    return 0
+
+
+
+# Read sites from a formatted file
+# Parsed files are cached in a binary .npz next to the source (see _trace_gas_cache_path),
+# so later reads skip the text parsing. The cache is rebuilt when the source file changes.
+# year can be one year or a list of years, start/end (UTC) narrow the window further.
+# Without a cache, rows outside the window are dropped chunk by chunk using the epoch 'time' column.
+
+@instrumented
+def read_trace_gas(path_and_filename, header,year,gas, cache = True, cache_dir = None, start = None, end = None):
+
+    windows = time_windows(year, start, end)
+
+    df = None
+    if cache:
+        cache_file = _trace_gas_cache_path(path_and_filename, header, cache_dir)
+        df = _load_trace_gas_cache(cache_file)
+
+    if df is None:
+        if cache:
+            df = _parse_trace_gas(path_and_filename, header, None)
+            _save_trace_gas_cache(cache_file, df)
+        else:
+            df = _parse_trace_gas(path_and_filename, header, windows)
+
+    df = df.loc[window_mask(_epoch_seconds(df.index), windows)]
+    df.loc[df[gas] == TRACE_GAS_FILL] = np.nan #replace -9999 by NAN
         
         
     return df
 
-# Read weather files, original wind speed in mph. It returns a df with
-#wind speed in ms, hourly averaged
 
-def read_weather(path,year):
-    
-    df = pd.read_csv(path)
-    df = df.rename({'valid': 'datetime_utc'}, axis='columns')
-    df.index = pd.to_datetime(df['datetime_utc'], format = '%Y-%m-%d %H:%M')
-    df = df.tz_localize(tz = 'UTC')
-       
-    df = pd.DataFrame(df.resample('H').mean())# resample so the mean is the full hour
-    df['WS_OBS'] = df['sped']/2.237  #(wind speed in mph -- convert to m/s) 
+def _parse_trace_gas(path_and_filename, header, windows):
 
-    del df['sped']; del df['drct']
+    reader = pd.read_csv(path_and_filename, comment = "#", names=header, chunksize = READ_CHUNK_ROWS)
+    if 'time' in header:
+        # epoch seconds are already in the file, no need to parse the time strings
+        with profile_stage('read_trace_gas: read_csv'):
+            df = _concat_chunks(chunk.loc[window_mask(chunk['time'].to_numpy(), windows)] for chunk in reader)
+        with profile_stage('read_trace_gas: to_datetime'):
+            df.index = pd.to_datetime(df['time'], unit = 's', utc = True)
+    else:
+        with profile_stage('read_trace_gas: read_csv'):
+            df = _concat_chunks(reader)
+        with profile_stage('read_trace_gas: to_datetime'):
+            df.index = pd.to_datetime(df['Date'])
+        df = df.loc[window_mask(_epoch_seconds(df.index), windows)]
 
-    df = df.loc[(df.index.year == year)]
+    df.index.name = 'datetime_utc'
+    for col in ['Date', 'time']:
+        if col in df.columns:
+            del df[col]
 
     return df
 
+# Streaming mode: yields batches of at most chunksize rows as dicts of arrays,
+# 'time' (int64 epoch seconds) plus gas, std_dev, n and uncertainty (float32 by default, NaN for -9999),
+# so summaries can be accumulated batch by batch with a fixed memory ceiling.
 
+TRACE_GAS_FILL = -9999
 
-# Read model outputs (datime utc)
+@instrumented
+def iter_trace_gas(path_and_filename, header, gas, year = None, start = None, end = None, chunksize = READ_CHUNK_ROWS,
+                   dtype = np.float32):
 
-def read_model_outputs(path_and_filename, header,year):
-    
-    df = pd.read_csv(path_and_filename, skiprows = 1,names=header)
-    df = df.rename({'Date': 'datetime_utc'}, axis='columns')    
+    windows = time_windows(year, start, end)
+    columns = [c for c in [gas, 'std_dev', 'n', 'uncertainty'] if c in header]
+    dtypes = dict({'time': np.int64}, **{c: dtype for c in columns})
+
+    reader = pd.read_csv(path_and_filename, comment = "#", names = header, usecols = ['time'] + columns,
+                         dtype = dtypes, chunksize = chunksize)
+    for chunk in reader:
+        keep = window_mask(chunk['time'].to_numpy(), windows)
+        if not keep.any():
+            continue
+
+        batch = {'time': chunk['time'].to_numpy()[keep]}
+        for c in columns:
+            values = chunk[c].to_numpy()[keep]
+            values[values == TRACE_GAS_FILL] = np.nan
+            batch[c] = values
+
+        yield batch
+
+# cache file name: source name + hash of (absolute path, header) + hash of (mtime, size); a new version
+# of a file replaces only the entries of the same path and header
+
+TRACE_GAS_CACHE_DIR = '.trace_gas_cache'
+
+def _trace_gas_cache_path(path_and_filename, header, cache_dir = None):
+
+    source = os.path.abspath(path_and_filename)
+    stat = os.stat(source)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(source), TRACE_GAS_CACHE_DIR)
+
+    source_key = '|'.join([source] + [str(h) for h in header])
+    source_digest = hashlib.sha1(source_key.encode('utf-8')).hexdigest()[:16]
+    version_digest = hashlib.sha1((str(stat.st_mtime_ns) + '|' + str(stat.st_size)).encode('utf-8')).hexdigest()[:16]
+
+    return os.path.join(cache_dir, '.'.join([os.path.basename(source), source_digest, version_digest, 'npz']))
+
+
+def _load_trace_gas_cache(cache_file):
+
+    if not os.path.exists(cache_file):
+        return None
     try:
-        df.index = pd.to_datetime(df['datetime_utc'], format = '%Y-%m-%d %H:%M:%S'); del df['datetime_utc']
-    except:
-        df.index = pd.to_datetime(df['datetime_utc'])
-        
-    df = df.resample('60min').mean()  
-    df = df.tz_localize(tz = 'UTC')
-    df = df.loc[(df.index.year == year)]
-    
+        with np.load(cache_file, allow_pickle = False) as data:
+            index = pd.to_datetime(data['__index__'], utc = bool(data['__utc__']))
+            index.name = str(data['__index_name__']) or None
+            columns = [str(c) for c in data['__columns__']]
+            df = pd.DataFrame({c: data['col_'+c] for c in columns}, index = index, columns = columns)
+    except (OSError, ValueError, KeyError):
+        return None # unreadable cache, parse the text file again
     
     return df
 
 
-## categorize variables
+def _save_trace_gas_cache(cache_file, df):
 
+    # only plain numeric columns are stored (no pickled objects in the cache)
+    if not all(np.issubdtype(dtype, np.number) for dtype in df.dtypes):
+        return
 
-def wind_category(df,var):
+    cache_dir = os.path.dirname(cache_file)
+    prefix = os.path.basename(cache_file).rsplit('.', 2)[0] + '.'
+    try:
+        os.makedirs(cache_dir, exist_ok = True)
+        # remove entries written for older versions of the same source file and header
+        for old in glob.glob(os.path.join(glob.escape(cache_dir), glob.escape(prefix) + '*.npz')):
+            os.remove(old)
+
+        arrays = {'col_'+str(c): df[c].to_numpy() for c in df.columns}
+        arrays['__columns__'] = np.array([str(c) for c in df.columns])
+        arrays['__utc__'] = np.array(df.index.tz is not None)
+        arrays['__index_name__'] = np.array(df.index.name or '')
+        index = df.index.tz_convert(None) if df.index.tz is not None else df.index
+        arrays['__index__'] = index.values.astype('datetime64[ns]').astype(np.int64)
+
+        tmp_file = cache_file + '.tmp.npz'
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass # read-only data directory: keep working without a cache
+
+# Read weather files, original wind speed in mph. It returns a df with
+#wind speed in ms, hourly averaged (hourly_means of sped, on the hours of the year(s))
+
+@instrumented
+def read_weather(path,year, start = None, end = None):
     
-    df[var+'_CAT'] = np.nan
+    windows = time_windows(year, start, end)
+    epoch, values = read_samples(path, 'valid', ['sped'], windows, '%Y-%m-%d %H:%M', dict(usecols = ['valid', 'sped']))
+
+    with profile_stage('read_weather: hourly means'):
+        df = hourly_means(epoch, values, windows, 'datetime_utc')
+    df['WS_OBS'] = df['sped']/2.237  #(wind speed in mph -- convert to m/s) 
+
+    del df['sped']
+
+    return df
+
+
+
+# Read model outputs (datime utc), hourly means of the header columns (20-min TKE included)
+
+@instrumented
+def read_model_outputs(path_and_filename, header,year, start = None, end = None):
     
-    df[var+'_CAT'].loc[(df[var] <2)] = 0 #'<2'
-    df[var+'_CAT'].loc[(df[var] >=2)&(df[var] <3)] = 1# '2-3'
-    df[var+'_CAT'].loc[(df[var] >=3)&(df[var] <4)] = 2#'3-4'
-    df[var+'_CAT'].loc[(df[var] >=4)&(df[var] <5)] = 3#'4-5'
-    df[var+'_CAT'].loc[(df[var] >=5)&(df[var] <6)] = 4#'5-6'
-    df[var+'_CAT'].loc[(df[var] >=6)] = 5#'>=6'
+    windows = time_windows(year, start, end)
+    epoch, values = read_samples(path_and_filename, 'Date', [c for c in header if c != 'Date'], windows,
+                                 '%Y-%m-%d %H:%M:%S', dict(skiprows = 1, names = header))
+
+    with profile_stage('read_model_outputs: hourly means'):
+        df = hourly_means(epoch, values, windows, 'datetime_utc')
     
     
-    return np.array(df[var+'_CAT'])
+    return df
 
 
-def abl_category(df,var):
+# Read the raw samples of a csv file: (epoch seconds, {column: float values}) of the rows inside the
+# time windows, at the file's own cadence (for hourly_means or align_hourly). Timestamps are parsed with
+# format, or inferred when they do not match it; read_csv = extra pd.read_csv options (names, usecols...).
 
-    df[var+'_CAT'] = np.nan
+@instrumented
+def read_samples(path, time_column, columns, windows = None, format = None, read_csv = None):
 
-    df[var+'_CAT'].loc[(df[var] <50)] = 0 
-    df[var+'_CAT'].loc[(df[var] >=50)&(df[var] <200)] = 1
-    df[var+'_CAT'].loc[(df[var] >=200)&(df[var] <350)] = 2
-    df[var+'_CAT'].loc[(df[var] >=350)&(df[var] <500)] = 3
-    df[var+'_CAT'].loc[(df[var] >=500)] = 4
+    epochs, values = [], {c: [] for c in columns}
+    with profile_stage('read_samples: read_csv + to_datetime'):
+        for chunk in pd.read_csv(path, chunksize = READ_CHUNK_ROWS, **(read_csv or {})):
+            try:
+                epoch = parse_epoch(chunk[time_column], format)
+            except ValueError:
+                epoch = parse_epoch(chunk[time_column])
+            keep = window_mask(epoch, windows)
+            epochs.append(epoch[keep])
+            for c in columns:
+                values[c].append(chunk[c].to_numpy(dtype = float)[keep])
 
-    return np.array(df[var+'_CAT'])
+    return np.concatenate(epochs), {c: np.concatenate(values[c]) for c in columns}
 
 
+## time windows (UTC) used by the readers to skip rows while reading
 
-def tke_category(df,var):
+# windows as an (n, 2) array of [start, end) epoch seconds, None means no filter
+@instrumented
+def time_windows(year = None, start = None, end = None):
 
-    df[var+'_CAT'] = np.nan
+    if year is None and start is None and end is None:
+        return None
 
-    df[var+'_CAT'].loc[(df[var] <1)] = 0 
-    df[var+'_CAT'].loc[(df[var] >=1)&(df[var] <1.2)] = 1
-    df[var+'_CAT'].loc[(df[var] >=1.2)&(df[var] <1.4)] = 2
-    df[var+'_CAT'].loc[(df[var] >=1.4)&(df[var] <1.6)] = 3
-    df[var+'_CAT'].loc[(df[var] >=1.6)] = 4
+    if year is None:
+        windows = [[np.iinfo(np.int64).min, np.iinfo(np.int64).max]]
+    else:
+        years = sorted(set(np.atleast_1d(year).astype(int)))
+        windows = [[_to_epoch(str(y)), _to_epoch(str(y+1))] for y in years]
+    windows = np.array(windows, dtype = np.int64)
 
-    return np.array(df[var+'_CAT'])
+    if start is not None:
+        windows[:, 0] = np.maximum(windows[:, 0], _to_epoch(start))
+    if end is not None:
+        windows[:, 1] = np.minimum(windows[:, 1], _to_epoch(end))
 
-#### add periods of day in local time
+    return windows[windows[:, 0] < windows[:, 1]]
 
-#- 5 - 9  am (night_subset == previous nighttime)
-#- 0 - 11 am (night == all night)
-#- 12 pm - 23 (day == all day)
-#- 17 - 21 (day_subset == afternoon)
 
+# True where the epoch seconds fall inside one of the windows
+@instrumented
+def window_mask(epoch, windows):
 
-def period_cat(df):
-    
-    df['PERIOD'] = np.nan
-    df['PERIOD'].loc[((df.index.hour >= 10)&(df.index.hour<=13))] = '5-8 AM LT' 
-    df['PERIOD'].loc[((df.index.hour >= 14)&(df.index.hour<=16))] = '9-11 AM LT'       
-    df['PERIOD'].loc[((df.index.hour >= 17)&(df.index.hour<=21))] = '12-4 PM LT'
-    df['PERIOD'].loc[((df.index.hour >= 22)|(df.index.hour==0)|(df.index.hour==1))] = '5-8 PM LT' 
-    df['PERIOD'].loc[((df.index.hour >= 2)&(df.index.hour<=4))] = '9-11 PM LT' 
-    df['PERIOD'].loc[((df.index.hour >= 5)&(df.index.hour<=9))] = '0-4 AM LT' 
-    
-    
-    return np.array(df['PERIOD'])
+    epoch = np.asarray(epoch, dtype = np.int64)
+    if windows is None:
+        return np.ones(len(epoch), dtype = bool)
+    if len(windows) == 0:
+        return np.zeros(len(epoch), dtype = bool) # empty window, e.g. year = 2016 with start = '2017-01-01'
 
-### add seasons (dormant vs growing)
+    i = np.searchsorted(windows[:, 0], epoch, side = 'right') - 1
+    return (i >= 0) & (epoch < windows[np.maximum(i, 0), 1])
 
-def season_cat(df):
 
-    df['SEASON'] = np.nan
-    df['SEASON'].loc[((df.index.month == 1) | (df.index.month == 2))] = 'DORMANT' ##|(df.index.month == 11) | (df.index.month == 12))
-    df['SEASON'].loc[((df.index.month == 5) | (df.index.month == 6) | 
-                                      (df.index.month == 7) | (df.index.month == 8))] = 'GROWING'
+def _to_epoch(when):
 
-    pd.options.mode.chained_assignment = None
-    
-    return np.array(df['SEASON'])
+    when = pd.Timestamp(when)
+    if when.tzinfo is None:
+        when = when.tz_localize('UTC') # naive dates are UTC, as in the data files
+    return int(when.value // 10**9)
 
 
+def _epoch_seconds(index):
 
-## errors // bias
-def errors(df, column_name_model, column_name_obs):
-    df['R_Error(%)'] = np.nan
-    df['R_Error(%)'] = 100*((df[column_name_model]-df[column_name_obs])/df[column_name_obs])   
-    
-    df['ABS_Error'] = np.nan
-    df['ABS_Error'] = abs(df[column_name_model]-df[column_name_obs])
-    
-    df['Error'] = np.nan
-    df['Error'] = (df[column_name_model]-df[column_name_obs])
+    if index.tz is not None:
+        index = index.tz_convert(None)
+    return index.values.astype('datetime64[s]').astype(np.int64)
+
+
+def _concat_chunks(chunks):
+
+    chunks = list(chunks)
+    return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+
+
+## hourly binning on integer epoch seconds
+# hourly_means floors epoch seconds to the hour (epoch // 3600) and averages each column per hour
+# with bincount (sums and counts of the non-NaN values), only for the columns it is given. The result
+# is dense on the hour grid of the time windows (every hour of the year for year = 2016, NaN where
+# there are no data) or, without windows, on every hour from the first to the last data hour.
+
+HOUR = 3600
+NAT_EPOCH = np.iinfo(np.int64).min # NaT as epoch seconds
+
+def hour_grid(epoch, windows = None):
+
+    epoch = np.asarray(epoch, dtype = np.int64)
+    epoch = epoch[epoch != NAT_EPOCH]
+    first = epoch.min() // HOUR * HOUR if len(epoch) else 0
+    last = epoch.max() // HOUR * HOUR + HOUR if len(epoch) else 0
+    if windows is None:
+        return np.arange(first, last, HOUR, dtype = np.int64)
+
+    grids = [np.array([], dtype = np.int64)] # empty grid for an empty window
+    for start, end in windows:
+        start = first if start == np.iinfo(np.int64).min else start // HOUR * HOUR
+        end = last if end == np.iinfo(np.int64).max else end
+        grids.append(np.arange(start, end, HOUR, dtype = np.int64))
+    return np.unique(np.concatenate(grids))
+
+
+# columns = {name: values}; returns a DataFrame on the hour grid (UTC DatetimeIndex named index_name)
+@instrumented
+def hourly_means(epoch, columns, windows = None, index_name = None):
+
+    epoch = np.asarray(epoch, dtype = np.int64)
+    grid = hour_grid(epoch, windows)
+    means = _bin_means(epoch, columns, grid)
+
+    return pd.DataFrame(means, index = _grid_index(grid, index_name), columns = list(columns))
+
+
+# position of each epoch's hour on the grid and whether it is on the grid at all
+def _hour_positions(epoch, grid):
+
+    hour = epoch // HOUR * HOUR
+    if len(grid) and grid[-1] - grid[0] == (len(grid) - 1)*HOUR:
+        position = (hour - grid[0]) // HOUR # one window: positions by arithmetic
+        valid = (epoch != NAT_EPOCH) & (position >= 0) & (position < len(grid))
+    else:
+        position = np.searchsorted(grid, hour)
+        valid = (epoch != NAT_EPOCH) & (position < len(grid))
+        valid[valid] = grid[position[valid]] == hour[valid] # rows between the windows
+    return position, valid
+
+
+def _bin_means(epoch, columns, grid):
+
+    position, valid = _hour_positions(epoch, grid)
+    means = {}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype = float)
+        keep = valid & ~np.isnan(values)
+        sums = np.bincount(position[keep], weights = values[keep], minlength = len(grid))
+        counts = np.bincount(position[keep], minlength = len(grid))
+        with np.errstate(invalid = 'ignore'):
+            means[name] = sums / counts # 0/0 is NaN for hours without data
+    return means
+
+
+def _grid_index(grid, name = None):
+
+    return pd.DatetimeIndex((grid*10**9).view('M8[ns]'), name = name).tz_localize('UTC')
+
+
+# timestamps (strings) to epoch seconds, NaT as NAT_EPOCH; ISO formats are parsed by numpy
+# (about 3x faster than pd.to_datetime), other formats and text numpy rejects by pandas
+ISO_FORMATS = ['%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S']
+
+def parse_epoch(strings, format = None):
+
+    if format in ISO_FORMATS:
+        try:
+            return np.asarray(strings, dtype = object).astype('datetime64[s]').astype(np.int64)
+        except (ValueError, TypeError):
+            pass
+    times = pd.to_datetime(strings, format = format)
+    return np.asarray(times).astype('datetime64[s]').astype(np.int64)
+
+
+## Alignment of sources with different cadences on one hourly grid
+# sources = {name: (epoch, {column: values}, rule, tolerance)} as read by read_samples, e.g. 20-min TKE,
+# METAR at :54, hourly WRF/ABL and XS. Every source goes onto the same hour grid (hour_grid of all
+# the sources within the windows, dense over the year(s)) with its rule:
+#   'mean'     mean of the values in [h, h + 1 hour), as hourly_means (tolerance is not used)
+#   'nearest'  value closest to the hour mark h, if within tolerance seconds (None: any distance)
+#   'asof'     last value at or before h, if not older than tolerance seconds (None: any age)
+# Missing values are skipped per column (nearest/asof take the closest non-missing value).
+# Returns one DataFrame on the grid built from the aligned arrays at once (no joins or reindexing);
+# a column name in two sources is an error.
+
+ALIGN_RULES = ['mean', 'nearest', 'asof']
+
+@instrumented
+def align_hourly(sources, windows = None, index_name = 'datetime_utc'):
+
+    names = [c for epoch, columns, rule, tolerance in sources.values() for c in columns]
+    repeated = sorted({c for c in names if names.count(c) > 1})
+    if repeated:
+        raise ValueError('columns in more than one source: %s' % ', '.join(repeated))
+    for name, (epoch, columns, rule, tolerance) in sources.items():
+        if rule not in ALIGN_RULES:
+            raise ValueError('%s: unknown rule %r (one of %s)' % (name, rule, ', '.join(ALIGN_RULES)))
+
+    epochs = [np.asarray(epoch, dtype = np.int64) for epoch, columns, rule, tolerance in sources.values()]
+    grid = hour_grid(np.concatenate(epochs) if epochs else np.array([], dtype = np.int64), windows)
+
+    aligned = {}
+    for epoch, (_, columns, rule, tolerance) in zip(epochs, sources.values()):
+        if rule == 'mean':
+            aligned.update(_bin_means(epoch, columns, grid))
+        else:
+            aligned.update(_align_samples(epoch, columns, grid, rule, tolerance))
+
+    return pd.DataFrame(aligned, index = _grid_index(grid, index_name), columns = names)
+
+
+# nearest / asof values of the grid hours, per column on its non-missing samples
+def _align_samples(epoch, columns, grid, rule, tolerance):
+
+    order = np.argsort(epoch, kind = 'stable')
+    epoch = epoch[order]
+    aligned = {}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype = float)[order]
+        keep = (epoch != NAT_EPOCH) & ~np.isnan(values)
+        times, values = epoch[keep], values[keep]
+        out = np.full(len(grid), np.nan)
+        if len(times):
+            after = np.searchsorted(times, grid, side = 'right') # first sample after each hour mark
+            before = np.maximum(after - 1, 0)
+            if rule == 'asof':
+                pick = before
+                distance = np.where(after > 0, grid - times[before], np.iinfo(np.int64).max)
+            else:
+                later = np.minimum(after, len(times) - 1)
+                d_before = np.where(after > 0, grid - times[before], np.iinfo(np.int64).max)
+                d_later = np.where(after < len(times), times[later] - grid, np.iinfo(np.int64).max)
+                pick = np.where(d_later < d_before, later, before) # ties go to the earlier sample
+                distance = np.minimum(d_before, d_later)
+            ok = distance <= (np.iinfo(np.int64).max - 1 if tolerance is None else tolerance)
+            out[ok] = values[pick[ok]]
+        aligned[name] = out
+    return aligned
+
+
+## categorize variables
+# edges are the lower bounds of every category after the first one,
+# e.g. wind: <2, 2-3, 3-4, 4-5, 5-6, >=6 m/s
+
+CATEGORY_EDGES = {
+    'wind': [2, 3, 4, 5, 6],      # m/s
+    'abl': [50, 200, 350, 500],   # m
+    'tke': [1.0, 1.2, 1.4, 1.6],  # m2/s2
+}
+
+CAT_MISSING = -1 # category code of missing values
+
+
+# category codes (int8) in a single pass, CAT_MISSING where the value is NaN
+@instrumented
+def categorize(values, edges):
+
+    values = np.asarray(values, dtype = float)
+    codes = np.searchsorted(np.asarray(edges, dtype = float), values, side = 'right').astype(np.int8)
+    codes[np.isnan(values)] = CAT_MISSING
+
+    return codes
+
+
+# categories as floats with NaN for missing values (what the figures and tables expect)
+@instrumented
+def category_values(values, edges):
+
+    codes = categorize(values, edges)
+    return np.where(codes == CAT_MISSING, np.nan, codes)
+
+
+@instrumented
+def wind_category(df,var):
     
-    return np.array(df['R_Error(%)']), np.array(df['ABS_Error']), np.array(df['Error'])
+    return category_values(df[var], CATEGORY_EDGES['wind'])
 
 
-## Attribute emissions to periods of the day
-def emissions(df):
-    df['EMISSIONS'] = np.nan
-    df['EMISSIONS'].loc[(df['SEASON'] == 'DORMANT') & (df['PERIOD'] == '0-4 AM LT')] = 0.48
-    df['EMISSIONS'].loc[(df['SEASON'] == 'DORMANT') & (df['PERIOD'] == '5-8 AM LT')] = 0.72
-    df['EMISSIONS'].loc[(df['SEASON'] == 'DORMANT') & (df['PERIOD'] == '9-11 AM LT')] = 0.87
-    df['EMISSIONS'].loc[(df['SEASON'] == 'DORMANT') & (df['PERIOD'] == '12-4 PM LT')] = 0.82
-    df['EMISSIONS'].loc[(df['SEASON'] == 'DORMANT') & (df['PERIOD'] == '5-8 PM LT')] = 0.96
-    df['EMISSIONS'].loc[(df['SEASON'] == 'DORMANT') & (df['PERIOD'] == '9-11 PM LT')] = 0.67
-
-    df['EMISSIONS'].loc[(df['SEASON'] == 'GROWING') & (df['PERIOD'] == '0-4 AM LT')] = 0.31
-    df['EMISSIONS'].loc[(df['SEASON'] == 'GROWING') & (df['PERIOD'] == '5-8 AM LT')] = 0.63
-    df['EMISSIONS'].loc[(df['SEASON'] == 'GROWING') & (df['PERIOD'] == '9-11 AM LT')] = 0.68
-    df['EMISSIONS'].loc[(df['SEASON'] == 'GROWING') & (df['PERIOD'] == '12-4 PM LT')] = 0.81
-    df['EMISSIONS'].loc[(df['SEASON'] == 'GROWING') & (df['PERIOD'] == '5-8 PM LT')] = 0.72
-    df['EMISSIONS'].loc[(df['SEASON'] == 'GROWING') & (df['PERIOD'] == '9-11 PM LT')] = 0.46
-
-    return np.array(df['EMISSIONS'])
+@instrumented
+def abl_category(df,var):
 
-#--------------------------------------------------------------------------------------------------------------------------
+    return category_values(df[var], CATEGORY_EDGES['abl'])
 
-### plots (figures)
 
-# vertical gradient normalized by time and categorized by wind speed
 
-def fig_vg_norm_time_ws(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/7.5 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<2','2-3','3-4','4-5','5-6','>6','']
+@instrumented
+def tke_category(df,var):
+
+    return category_values(df[var], CATEGORY_EDGES['tke'])
+
+#### add periods of day in local time
+
+# first and last local hour of each period
+PERIOD_HOURS = {'0-4 AM LT': (0, 4), '5-8 AM LT': (5, 8), '9-11 AM LT': (9, 11),
+                '12-4 PM LT': (12, 16), '5-8 PM LT': (17, 20), '9-11 PM LT': (21, 23)}
+
+# Station registry: Stations.csv next to this script, one row per tower or airport with
+# code, city, IANA time zone, lat, lon, elevation (m) and an optional file encoding.
+# It is read once; lookups by code are dictionary lookups.
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+STATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Stations.csv')
 
-    for period in periods_list: 
+@functools.lru_cache(maxsize = None)
+@instrumented
+def load_stations(path = STATIONS_FILE):
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+    stations = pd.read_csv(path, dtype = {'code': str, 'encoding': str}).set_index('code')
+    stations['encoding'] = stations['encoding'].where(stations['encoding'].notna(), None)
 
-        ax.bar(df['VG'][period].index+bw_n-0.3, df['VG'][period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+    return stations
 
 
-        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
-        if gas == 'co2':
-            ax.set_ylabel(r'$\widetilde{VG}[$CO$_2$]$_{[time]}$', fontsize=95)
+@functools.lru_cache(maxsize = None)
+def _station_records(path = STATIONS_FILE):
 
-        if gas == 'ch4':
-            ax.set_ylabel(r'$\widetilde{VG}[$CH$_4$]$_{[time]}$', fontsize=95)
+    return load_stations(path).to_dict(orient = 'index')
 
-        ax.set_ylim(0,32)
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
+# registry entry of a station as a dict (KeyError for unknown codes)
+@instrumented
+def station_info(code):
 
-    ax.axhline(y = 2.5, color = 'r', linestyle = '-.', linewidth = 4, label = '2.5x afternoon')
-    ax.axhline(y = 1, color = 'k', linestyle = '-.', linewidth = 4, label = '1.0x afternoon')
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
+    return _station_records()[code]
 
 
+@instrumented
+def site_timezone(code, default = None):
 
+    record = _station_records().get(code)
+    if record is None:
+        if default is None:
+            raise KeyError('station ' + str(code) + ' is not in ' + STATIONS_FILE)
+        return default
 
-# vertical gradient normalized by time and categorized by turbulent kinetic energy
-def fig_vg_time_tke(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/11 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<1.0','','1.0-1.2','','1.2-1.4','','1.4-1.6','','>1.6','']
+    return record['timezone']
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
 
-    for period in periods_list: 
+@instrumented
+def station_city(code):
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+    record = _station_records().get(code)
+    return code if record is None else record['city']
 
-        ax.bar(df['VG'][period].index+bw_n-0.3, df['VG'][period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
 
+# without a site or time zone, and for sites missing from Stations.csv: Indianapolis standard time
+# (UTC-5) all year, as in the paper
+DEFAULT_TIMEZONE = 'Etc/GMT+5'
 
-        ax.set_xlabel('TKE (m$^2$/s$^2$)', fontsize=95)
-        if gas == 'co2':
-            ax.set_ylabel(r'$\widetilde{VG}[$CO$_2$]$_{[time]}$', fontsize=95)
+# default of site_tz in build_store and vertical_gradients (and so in Run_Report and wind_store):
+# periods in the time zone of each site from Stations.csv (with daylight saving time);
+# site_tz=False puts every site in DEFAULT_TIMEZONE
+SITE_TZ = True
 
-        if gas == 'ch4':
-            ax.set_ylabel(r'$\widetilde{VG}[$CH$_4$]$_{[time]}$', fontsize=95)
 
-        ax.set_ylim(0,15)
+# 24-entry table: local hour -> period code (-1 for hours outside every period)
+@instrumented
+def period_table(period_hours = PERIOD_HOURS):
 
+    table = np.full(24, -1, dtype = np.int8)
+    for code, (first, last) in enumerate(period_hours.values()):
+        table[first:last+1] = code
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
+    return table
 
-    ax.axhline(y = 2.5, color = 'r', linestyle = '-.', linewidth = 4, label = '2.5x afternoon')
-    ax.axhline(y = 1, color = 'k', linestyle = '-.', linewidth = 4, label = '1.0x afternoon')
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
 
+# local hour of a (UTC or naive UTC) DatetimeIndex; site can be one code or one code per row
+# (DEFAULT_TIMEZONE for codes missing from Stations.csv)
+@instrumented
+def local_hour(index, site = None, tz = None):
 
+    if index.tz is None:
+        index = index.tz_localize('UTC')
 
-# vertical gradient normalized by time and emissions and categorized by wind speed
+    if tz is not None or site is None or np.ndim(site) == 0:
+        if tz is None:
+            tz = site_timezone(site, DEFAULT_TIMEZONE) if site is not None else DEFAULT_TIMEZONE
+        return np.asarray(index.tz_convert(tz).hour)
 
-def fig_vg_time_emis_ws(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/7.5 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<2','2-3','3-4','4-5','5-6','>6','']
+    site = np.asarray(site)
+    hours = np.empty(len(index), dtype = np.int64)
+    for key in pd.unique(site):
+        rows = site == key
+        hours[rows] = index[rows].tz_convert(site_timezone(key, DEFAULT_TIMEZONE)).hour
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+    return hours
 
-    for period in periods_list: 
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+@instrumented
+def period_cat(df, site = None, tz = None, period_hours = PERIOD_HOURS):
+    
+    codes = period_table(period_hours)[local_hour(df.index, site, tz)]
+    
+    return pd.Categorical.from_codes(codes, categories = list(period_hours))
+
+### add seasons (dormant vs growing)
 
-        ax.bar(df['VG_EM'][period].index+bw_n-0.3, df['VG_EM'][period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+# months of each season (March-April and September-December are left out)
+SEASON_MONTHS = {'DORMANT': [1, 2], 'GROWING': [5, 6, 7, 8]}
 
 
-        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
+# 13-entry table: month -> season code (-1 for months outside every season, entry 0 unused)
+@instrumented
+def season_table(season_months = SEASON_MONTHS):
 
-        ax.set_ylabel(r'$\widetilde{VG}[$CO$_2$]$_{[time;emission]}$', fontsize=65)
+    table = np.full(13, -1, dtype = np.int8)
+    for code, months in enumerate(season_months.values()):
+        table[months] = code
 
+    return table
 
-        ax.set_ylim(0,32)
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
+@instrumented
+def season_cat(df, season_months = SEASON_MONTHS):
 
-    ax.axhline(y = 2.5, color = 'r', linestyle = '-.', linewidth = 4, label = '2.5x afternoon')
-    ax.axhline(y = 1, color = 'k', linestyle = '-.', linewidth = 4, label = '1.0x afternoon')
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
+    codes = season_table(season_months)[df.index.month]
+
+    pd.options.mode.chained_assignment = None
+    
+    return pd.Categorical.from_codes(codes, categories = list(season_months))
+
+
+
+
+## errors // bias
+@instrumented
+def errors(df, column_name_model, column_name_obs):
+    df['R_Error(%)'] = np.nan
+    df['R_Error(%)'] = 100*((df[column_name_model]-df[column_name_obs])/df[column_name_obs])   
+    
+    df['ABS_Error'] = np.nan
+    df['ABS_Error'] = abs(df[column_name_model]-df[column_name_obs])
+    
+    df['Error'] = np.nan
+    df['Error'] = (df[column_name_model]-df[column_name_obs])
+    
+    return np.array(df['R_Error(%)']), np.array(df['ABS_Error']), np.array(df['Error'])
 
 
+## Attribute emissions to periods of the day
+# fossil-fuel emission factors for Indianapolis (season x period of the day)
 
-# vertical gradient normalized by time and emissions and categorized by turbulent kinetic energy
+EMISSION_FACTORS = pd.DataFrame([[0.48, 0.72, 0.87, 0.82, 0.96, 0.67],
+                                 [0.31, 0.63, 0.68, 0.81, 0.72, 0.46]],
+                                index = list(SEASON_MONTHS), columns = list(PERIOD_HOURS))
 
-def fig_vg_time_emis_tke(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/11 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<1.0','','1.0-1.2','','1.2-1.4','','1.4-1.6','','>1.6','']
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+# emission factors from a csv file: one row per season, one column per period
+# (same layout as EMISSION_FACTORS, e.g. DATA_SAMPLE/EMISSION_FACTORS_indianapolis.csv)
+@instrumented
+def load_emission_factors(path):
 
-    for period in periods_list: 
+    return pd.read_csv(path, index_col = 0).astype(float)
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
 
-        ax.bar(df['VG_EM'][period].index+bw_n-0.3, df['VG_EM'][period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+@instrumented
+def emissions(df, factors = None):
 
+    if factors is None:
+        factors = EMISSION_FACTORS
+    if isinstance(factors, str):
+        factors = load_emission_factors(factors)
 
-        ax.set_xlabel('TKE (m$^2$/s$^2$)', fontsize=95)
+    season = pd.Categorical(df['SEASON'], categories = factors.index).codes
+    period = pd.Categorical(df['PERIOD'], categories = factors.columns).codes
+    valid = (season >= 0) & (period >= 0)
 
-        ax.set_ylabel(r'$\widetilde{VG}[$CO$_2$]$_{[time;emission]}$', fontsize=65)
+    values = np.full(len(df), np.nan)
+    values[valid] = factors.to_numpy(dtype = float)[season[valid], period[valid]]
 
+    return values
 
-        ax.set_ylim(0,15)
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
 
-    ax.axhline(y = 2.5, color = 'r', linestyle = '-.', linewidth = 4, label = '2.5x afternoon')
-    ax.axhline(y = 1, color = 'k', linestyle = '-.', linewidth = 4, label = '1.0x afternoon')
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
+## Multi-site hourly store
+# One frame for every site, indexed by (SITE, datetime_utc) in UTC, with categorical PERIOD,
+# SEASON and <column>_CAT columns (categories = {column: 'wind', 'abl' or 'tke'}).
+# Periods are in the local time of each site from Stations.csv, or in DEFAULT_TIMEZONE with site_tz=False (see SITE_TZ).
+# Period, season or category subsets are boolean masks or groupby keys on this frame, not copies.
 
+@instrumented
+def build_store(frames, categories = None, site_tz = SITE_TZ, columns = None):
 
-# boundary layer relative bias categorized by wind speed
+    parts = []
+    for site, df in frames.items():
+        if columns is not None:
+            df = df[columns]
+        index = df.index.tz_localize('UTC') if df.index.tz is None else df.index.tz_convert('UTC')
+        parts.append(df.set_axis(index.rename('datetime_utc'), axis = 0))
+    store = pd.concat(parts, keys = list(frames), names = ['SITE', 'datetime_utc'])
 
-def fig_bld_RBias(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/7.5 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<2','2-3','3-4','4-5','5-6','>6','']
+    frame = pd.DataFrame(index = store.index.get_level_values('datetime_utc'))
+    sites = np.asarray(store.index.get_level_values('SITE')) if site_tz else None
+    store['PERIOD'] = period_cat(frame, site = sites)
+    store['SEASON'] = season_cat(frame)
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+    for column, kind in (categories or {}).items():
+        edges = CATEGORY_EDGES[kind]
+        store[column+'_CAT'] = pd.Categorical.from_codes(categorize(store[column], edges),
+                                                         categories = np.arange(len(edges)+1), ordered = True)
 
-    for period in periods_list: 
+    return store
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
 
-        ax.bar(df[period].index+bw_n-0.3, df[period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+## Emission providers: hourly fossil-fuel emissions at a site
+# A provider has a method hourly(site, year) returning a Series of emissions on the
+# UTC hourly grid of that year (year_hours). hourly_emissions() joins it to a data frame.
 
 
-        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
+# UTC hourly grid of a year
+@instrumented
+def year_hours(year):
 
-        ax.set_ylabel(r'BLD bias$_{[time]}$ (%)', fontsize=65)
+    start = pd.Timestamp(str(year), tz = 'UTC')
+    n_hours = int((pd.Timestamp(str(year+1), tz = 'UTC') - start) / pd.Timedelta('60min'))
 
+    return pd.date_range(start, periods = n_hours, freq = '60min', name = 'datetime_utc')
 
-        ax.set_ylim(-50,500)
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
+# emissions of each row of df (DatetimeIndex in UTC), taken from the provider's hourly series
+@instrumented
+def hourly_emissions(df, provider, site):
 
-    ax.axhline(y = 30, color = 'r', linestyle = '-.', linewidth = 4, label = '$\pm$30%')
-    ax.axhline(y = -30, color = 'r', linestyle = '-.', linewidth = 4)
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
+    index = df.index if df.index.tz is not None else df.index.tz_localize('UTC')
+    index = index.tz_convert('UTC').floor('60min')
 
+    series = pd.concat([provider.hourly(site, year) for year in np.unique(index.year)])
 
+    return series.reindex(index).to_numpy()
 
-# boundary layer relative bias categorized by turbulent kinetic energy
 
-def fig_bld_RBias_tke(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/11 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<1.0','','1.0-1.2','','1.2-1.4','','1.4-1.6','','>1.6','']
+# season x period factors (default: today's emissions() values), flat within each period
+class FlatEmissionProvider:
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+    def __init__(self, factors = None, tz = None):
 
-    for period in periods_list: 
+        self.factors = factors
+        self.tz = tz # None: periods in the time zone of each site, as period_cat(df, site)
+        self._cache = {}
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+    @instrumented
+    def hourly(self, site, year):
 
-        ax.bar(df['R_Error(%)'][period].index+bw_n-0.3, df['R_Error(%)'][period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+        if (site, year) not in self._cache:
+            frame = pd.DataFrame(index = year_hours(year))
+            frame['SEASON'] = season_cat(frame)
+            frame['PERIOD'] = period_cat(frame, site = site, tz = self.tz)
+            self._cache[site, year] = pd.Series(emissions(frame, self.factors), index = frame.index, name = 'EMISSIONS')
 
+        return self._cache[site, year]
 
-        ax.set_xlabel('TKE (m$^2$/s$^2$)', fontsize=95)
 
-        ax.set_ylabel(r'BLD bias$_{[time]}$ (%)', fontsize=65)
+# hourly fluxes from a tabular (flattened grid) inventory file with columns
+# datetime_utc, lat, lon, flux, sampled at each tower with footprint weights:
+# footprints = {site: [(lat, lon, weight), ...]}
+# Sampled series are kept in memory and, with cache_dir, saved as .npz per site/year.
+class InventoryEmissionProvider:
 
+    def __init__(self, path, footprints, cache_dir = None, decimals = 4):
 
-        ax.set_ylim(-50,500)
+        self.path = path
+        self.footprints = footprints
+        self.cache_dir = cache_dir
+        self.decimals = decimals # lat/lon rounding used to match inventory cells
+        self._cache = {}
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
+    @instrumented
+    def hourly(self, site, year):
 
-    ax.axhline(y = 30, color = 'r', linestyle = '-.', linewidth = 4, label = '$\pm$30%')
-    ax.axhline(y = -30, color = 'r', linestyle = '-.', linewidth = 4)
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
+        if (site, year) in self._cache:
+            return self._cache[site, year]
 
+        cache_file = self._cache_file(site, year)
+        if cache_file is not None and os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                values = data['flux']
+        else:
+            values = self._sample(site, year)
+            if cache_file is not None:
+                os.makedirs(self.cache_dir, exist_ok = True)
+                np.savez(cache_file, flux = values)
 
+        self._cache[site, year] = pd.Series(values, index = year_hours(year), name = 'EMISSIONS')
 
-# boundary layer bias categorized by wind speed
+        return self._cache[site, year]
 
-def fig_bld_Bias(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/7.5 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<2','2-3','3-4','4-5','5-6','>6','']
+    def _sample(self, site, year):
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+        footprint = pd.DataFrame(self.footprints[site], columns = ['lat', 'lon', 'weight'])
+        footprint[['lat', 'lon']] = footprint[['lat', 'lon']].round(self.decimals)
+        footprint = footprint.groupby(['lat', 'lon'], as_index = False)['weight'].sum()
 
-    for period in periods_list: 
+        hours = year_hours(year)
+        windows = time_windows(year)
+        total = np.zeros(len(hours))
+        count = np.zeros(len(hours))
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+        for chunk in pd.read_csv(self.path, chunksize = READ_CHUNK_ROWS):
+            chunk.index = pd.to_datetime(chunk['datetime_utc'])
+            chunk = chunk.loc[window_mask(_epoch_seconds(chunk.index), windows)]
+            chunk[['lat', 'lon']] = chunk[['lat', 'lon']].round(self.decimals)
+            chunk = chunk.merge(footprint, on = ['lat', 'lon'], how = 'inner')
 
-        ax.bar(df[period].index+bw_n-0.3, df[period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+            hour = (pd.to_datetime(chunk['datetime_utc'], utc = True) - hours[0]) // pd.Timedelta('60min')
+            total += np.bincount(hour, weights = chunk['flux']*chunk['weight'], minlength = len(hours))
+            count += np.bincount(hour, minlength = len(hours))
 
+        return np.where(count > 0, total, np.nan)
 
-        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
+    def _cache_file(self, site, year):
 
-        ax.set_ylabel(r'BLD bias$_{[time]}$ (m)', fontsize=65)
+        if self.cache_dir is None:
+            return None
 
+        stat = os.stat(self.path)
+        key = '|'.join([os.path.abspath(self.path), str(stat.st_mtime_ns), str(stat.st_size),
+                        str(site), str(year), str(self.decimals), repr(self.footprints[site])])
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
 
+        return os.path.join(self.cache_dir, str(site) + '_' + str(year) + '.' + digest + '.npz')
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
 
 
-# enhancement categorized by wind speed
+## Vertical gradients (VG) for towers with several inlet heights
+# towers = {site: {inlet height (m): path_and_filename}}, all files with the same header and at least
+# two heights per site (ValueError otherwise).
+# Every file is placed on the integer hour grid of the year, giving one (sites, heights, hours)
+# array; VG is the gradient between the lowest and the highest inlet of each site (gas units/m).
+# VG_NORM = VG / afternoon VG and VG_EM = VG_NORM / (emissions / afternoon emissions), where the
+# afternoon ('12-4 PM LT') medians are taken per site and season.
+# The default provider gives EMISSIONS in the same periods as PERIOD.
+# Periods are in the time zone of each site from Stations.csv, or in DEFAULT_TIMEZONE with site_tz=False (see SITE_TZ).
 
-def fig_xs_ws(df, var, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/7.5 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
+@instrumented
+def vertical_gradients(towers, header, gas, year, provider = None, site_tz = SITE_TZ):
 
-      
+    if provider is None:
+        provider = FlatEmissionProvider(tz = None if site_tz else DEFAULT_TIMEZONE)
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+    sites = list(towers)
+    single = [site for site in sites if len(towers[site]) < 2]
+    if single:
+        raise ValueError('vertical gradients need at least two inlet heights per site: %s' % ', '.join(map(str, single)))
+    hours = year_hours(year)
+    first_hour = _to_epoch(str(year)) // 3600
+    n_heights = max(len(towers[site]) for site in sites)
 
-    for period in periods_list: 
-        
- 
+    z = np.full((len(sites), n_heights), np.nan)
+    conc = np.full((len(sites), n_heights, len(hours)), np.nan)
+    for i, site in enumerate(sites):
+        for j, height in enumerate(sorted(towers[site])):
+            z[i, j] = height
+            for batch in iter_trace_gas(towers[site][height], header, gas, year = year, dtype = np.float64):
+                conc[i, j, batch['time'] // 3600 - first_hour] = batch[gas]
+
+    # lowest inlet is always slot 0, the highest is the last filled slot
+    top = (np.sum(np.isfinite(z), axis = 1) - 1)
+    rows = np.arange(len(sites))
+    vg = (conc[rows, top, :] - conc[:, 0, :]) / (z[rows, top] - z[:, 0])[:, None]
+
+    df = pd.DataFrame({'VG': vg.ravel()},
+                      index = pd.MultiIndex.from_product([sites, hours], names = ['SITE', 'datetime_utc']))
+    site_codes = np.repeat(rows, len(hours))
+    times = pd.DatetimeIndex(np.tile(hours, len(sites)))
+    frame = pd.DataFrame(index = times)
+
+    df['SEASON'] = season_cat(frame)
+    df['PERIOD'] = period_cat(frame, site = np.repeat(sites, len(hours)) if site_tz else None)
+    df['EMISSIONS'] = np.concatenate([provider.hourly(site, year).to_numpy() for site in sites])
+
+    # afternoon medians per (site, season) cell
+    season = df['SEASON'].cat.codes.to_numpy()
+    cell = np.where(season >= 0, site_codes*len(SEASON_MONTHS) + season, -1)
+    afternoon = (df['PERIOD'] == '12-4 PM LT').to_numpy()
+    df['VG_NORM'] = df['VG'].to_numpy() / _cell_medians(df['VG'].to_numpy(), cell, afternoon)
+    df['VG_EM'] = df['VG_NORM'].to_numpy() / (df['EMISSIONS'].to_numpy() / _cell_medians(df['EMISSIONS'].to_numpy(), cell, afternoon))
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+    return df
 
-        ax.bar(df[period].index+bw_n-0.3, df[period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
 
+# median of values over the selected rows of each cell, broadcast back to every row (NaN for empty cells)
+def _cell_medians(values, cell, selected):
 
-        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
+    use = selected & np.isfinite(values) & (cell >= 0)
+    medians = pd.Series(values[use]).groupby(cell[use]).median()
 
-        
-        if var == 'XS':
-            ax.set_ylabel(r'CO$_2$ xs$_{obs}$ (ppm)', fontsize=95)
-            ax.set_ylim(0,15)
-            
-        if var == 'XS_MODEL':
-            ax.set_ylabel(r'CO$_2$ xs$_{model}$ (ppm)', fontsize=95)
-            ax.set_ylim(0,15)
-        
-        if var == 'XS_FF_BLD':
-            ax.set_ylabel(r'CO$_2$ xs$_{obs}$/ff$_{emissions}$/BLD$_{obs}$' "\n" r'$\regular_{(ppm) * (mol/h * 10^{8})^{-1} * (m)^{-1}}$', fontsize=75)
-            ax.set_ylim(0,0.4)
-            
-        if var == 'XSModel_FF_BLD':
-            ax.set_ylabel(r'CO$_2$ xs$_{model}$/ff$_{emissions}$/BLD$_{model}$' "\n" r'$\regular_{(ppm) * (mol/h * 10^{8})^{-1} * (m)^{-1}}$', fontsize=75)
-            ax.set_ylim(0,0.4)
-
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        try:
-            x = ['','<2','2-3','3-4','4-5','5-6','>6','']
-            ax.set_xticklabels(x)
-        except ValueError:
-            x = ['<2','2-3','3-4','4-5','5-6','>6'] 
-            ax.set_xticklabels(x)
-        
-        
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
-        
-    ax.set_xlim(0.45,5.5)
+    lookup = np.full(max(cell.max() + 1, 1), np.nan)
+    lookup[medians.index.to_numpy()] = medians.to_numpy()
 
-  
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
+    return np.where(cell >= 0, lookup[np.maximum(cell, 0)], np.nan)
 
 
+## Grouped statistics cube
+# count, sum, sum of squares, mean, median and SEM of each value column for every cell of `by`
+# (columns or index levels, e.g. ['SITE', 'SEASON', 'PERIOD', 'WS_OBS_CAT']), built from one groupby
+# of the hourly frame. Columns are (variable, statistic); figures and tables slice it with cube_table,
+# cube_collapse and table_mae_bias_cube instead of grouping the hourly data again.
 
-# enhancement categorized by turbulent kinetic energy
+CUBE_STATS = ['count', 'sum', 'sumsq', 'mean', 'median', 'sem']
 
-def fig_xs_tke(df, var, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/11 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<1.0','','1.0-1.2','','1.2-1.4','','1.4-1.6','','>1.6','']
+@instrumented
+def stat_cube(df, values, by):
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+    values = [values] if isinstance(values, str) else list(values)
+    by = [by] if isinstance(by, str) else list(by)
 
-    for period in periods_list: 
+    data = df[values].astype(float)
+    squares = (data**2).add_suffix('^2')
+    keys = _group_keys(df, by)
+    grouped = pd.concat([data, squares], axis = 1).groupby(keys, observed = True)
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+    sums = grouped.sum(min_count = 1)
+    counts = grouped.count()
+    medians = grouped[values].median()
 
-        ax.bar(df[period].index+bw_n-0.3, df[period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+    cube = {}
+    for var in values:
+        cube[var, 'count'] = counts[var]
+        cube[var, 'sum'] = sums[var].fillna(0)
+        cube[var, 'sumsq'] = sums[var+'^2'].fillna(0)
+        cube[var, 'median'] = medians[var]
+    cube = pd.DataFrame(cube).sort_index() # categorical levels in category order
 
+    return _cube_moments(cube, values)
 
-        ax.set_xlabel('TKE (m$^2$/s$^2$)', fontsize=95)
 
-        
-        if var == 'XS':
-            ax.set_ylabel(r'CO$_2$ xs$_{obs}$ (ppm)', fontsize=95)
-            ax.set_ylim(0,15)
-            
-        if var == 'XS_MODEL':
-            ax.set_ylabel(r'CO$_2$ xs$_{model}$ (ppm)', fontsize=95)
-            ax.set_ylim(0,15)
-        
-        if var == 'XS_FF_BLD':
-            ax.set_ylabel(r'CO$_2$ xs$_{obs}$/ff$_{emissions}$/BLD$_{obs}$' "\n" r'$\regular_{(ppm) * (mol/h * 10^{8})^{-1} * (m)^{-1}}$', fontsize=75)
-            ax.set_ylim(0,0.22)
-            
-        if var == 'XSModel_FF_BLD':
-            ax.set_ylabel(r'CO$_2$ xs$_{model}$/ff$_{emissions}$/BLD$_{model}$' "\n" r'$\regular_{(ppm) * (mol/h * 10^{8})^{-1} * (m)^{-1}}$', fontsize=75)
-            ax.set_ylim(0,0.22)
-
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
-        
-   
-    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
+# groupby keys from columns or index levels
+def _group_keys(df, by):
 
-    return ax
+    return [df[k] if k in df.columns else df.index.get_level_values(k) for k in by]
 
 
-# enhancement/co2difference categorized by wind speed
+# mean and SEM from count, sum and sum of squares
+def _cube_moments(cube, values):
 
-def fig_xs_diff(df,df_sem, periods_list,gas):
+    for var in values:
+        n = cube[var, 'count'].astype(float)
+        mean = cube[var, 'sum'] / n.where(n > 0)
+        var_sample = ((cube[var, 'sumsq'] - n*mean**2) / (n - 1).where(n > 1)).clip(lower = 0)
+        cube[var, 'mean'] = mean
+        cube[var, 'sem'] = np.sqrt(var_sample / n)
 
-    n = 2*len(periods_list)
+    columns = [(var, stat) for var in values for stat in CUBE_STATS]
+    return cube.reindex(columns = pd.MultiIndex.from_tuples(columns))
 
-    fig, ax = plt.subplots(figsize=(45, 25)) #DCO2 VS TKE
-    bw = 1/11 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
 
-    df.replace([np.inf, -np.inf], np.nan, inplace=True)
-    ax.bar(df.index, df, 
-            yerr=(df_sem), ecolor='black',width = bw*11, 
-            error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-            color = my_colors, hatch = np.where(df.index == '12-4 PM LT','X',None),
-            label = None) #color = site01_color, 
+# merge cells over the levels not in keep (e.g. all categories of a period); count, sum and sumsq
+# add up, mean and SEM are recomputed and the median (not mergeable) becomes NaN
+@instrumented
+def cube_collapse(cube, keep):
 
-    ax.set_ylabel(r'CO$_2$ xs$_{obs}$/$\mid$CO$_2$diff$\mid$', fontsize=95)
+    keep = [keep] if isinstance(keep, str) else list(keep)
+    values = list(dict.fromkeys(cube.columns.get_level_values(0)))
 
-    ax.tick_params(axis = 'y',labelsize = 95)    
-    ax.tick_params(axis = 'x',labelsize=80,rotation = 30)
-    ax.grid(axis='y',alpha = 1)
-    ax.set_ylim(0,20)
-    bw_n = bw_n+bw
-    i = i+1
-    ax.axhline(y = 1, color = 'k', linestyle = '-.', linewidth = 4, label = r'CO$_2$ xs$_{obs}$/$\mid$CO$_2$diff$\mid$ = 1.0')
-    ax.legend(loc = 'upper right',fontsize =55)#,title='Wind speed > 5m/s', title_fontsize = 55)
+    additive = [(var, stat) for var in values for stat in ['count', 'sum', 'sumsq']]
+    merged = cube[additive].groupby(level = keep, observed = True).sum()
+    for var in values:
+        merged[var, 'median'] = np.nan
 
+    return _cube_moments(merged, values)
 
-# vertical gradient categorized by wind speed
 
-def fig_vg_time_ws(df, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/7.5 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<2','2-3','3-4','4-5','5-6','>6','']
+# one statistic as a table (index x columns, by default category x period), the layout the fig_*
+# functions read as df[period]; var can be a list, giving df[var][period]. Other cube levels are
+# fixed with keyword arguments, e.g. cube_table(cube, 'VG', 'median', SITE='SITE02', SEASON='DORMANT')
+@instrumented
+def cube_table(cube, var, stat = 'mean', index = 'WS_OBS_CAT', columns = 'PERIOD', **fixed):
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+    if not isinstance(var, str):
+        return pd.concat([cube_table(cube, v, stat, index, columns, **fixed) for v in var], axis = 1, keys = var)
 
-    for period in periods_list: 
+    table = cube[var, stat]
+    for level, value in fixed.items():
+        table = table.xs(value, level = level)
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+    return table.unstack(columns)
 
-        ax.bar(df['VG'][period].index+bw_n-0.3, df['VG'][period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
 
+## Running (incremental) version of the statistics cube
+# Keeps count, sum, sum of squares, min and max of each value column per cell of `by`, plus a
+# sparse histogram of values rounded to `resolution` for the medians. update(new_hours) folds in
+# only the rows newer than the last hour already seen (per SITE whenever the data has a SITE column
+# or index level, moved forward once the rows are folded in), and
+# to_cube() gives the stat_cube layout (plus min and max). Everything but the median matches
+# stat_cube on the same rows to float precision; medians are exact for data recorded with the
+# resolution's precision (e.g. 0.01 ppm) and within resolution/2 otherwise.
 
-        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
-        if gas == 'co2':
-            ax.set_ylabel(r'VG[CO$_2$]$_{[time]}$ (ppm/m)', fontsize=95)
-            ax.set_ylim(-0.78,0.1)
+class RunningCube:
 
-        if gas == 'ch4':
-            ax.set_ylabel(r'VG[CH$_4$]$_{[time]}$ (ppb/m)', fontsize=95)
-            ax.set_ylim(-5,0.1)
+    def __init__(self, values, by, resolution = 0.001):
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
-    ax.legend(fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
+        self.values = [values] if isinstance(values, str) else list(values)
+        self.by = [by] if isinstance(by, str) else list(by)
+        self.resolution = resolution
+        self.moments = None  # (cell) x (var, count/sum/sumsq/min/max)
+        self.sketch = None   # counts indexed by (cell, VAR, BUCKET)
+        self.last_hour = {}  # SITE (or None) -> last timestamp folded in
 
+    @instrumented
+    def update(self, new_hours):
 
-# vertical gradient normalized by ff emissions categorized by wind speed
+        keep, last_hour = self._new_rows(new_hours)
+        new_hours = new_hours.loc[keep]
+        if len(new_hours) == 0:
+            return self
 
-def fig_VGFF_ws(df, var, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/7.5 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<2','2-3','3-4','4-5','5-6','>6','']
-  
+        keys = [new_hours[k] if k in new_hours.columns else new_hours.index.get_level_values(k) for k in self.by]
+        data = new_hours[self.values].astype(float)
+        grouped = data.groupby(keys, observed = True)
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+        moments = pd.concat({'count': grouped.count(), 'sum': grouped.sum(), 'sumsq': (data**2).groupby(keys, observed = True).sum(),
+                             'min': grouped.min(), 'max': grouped.max()}, axis = 1).swaplevel(axis = 1)
+        moments = moments if self.moments is None else self._merge_moments(self.moments, moments)
 
-    for period in periods_list: 
+        long = pd.DataFrame({k: np.asarray(key) for k, key in zip(self.by, keys)})
+        long = long.join(data.reset_index(drop = True)).melt(id_vars = self.by, var_name = 'VAR', value_name = 'VALUE')
+        long = long.dropna(subset = ['VALUE'])
+        long['BUCKET'] = np.round(long['VALUE'].to_numpy() / self.resolution).astype(np.int64)
+        sketch = long.groupby(self.by + ['VAR', 'BUCKET'], observed = True).size()
+        sketch = sketch if self.sketch is None else self.sketch.add(sketch, fill_value = 0).astype(np.int64)
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+        self.moments, self.sketch = moments, sketch
+        self.last_hour.update(last_hour)
 
-        ax.bar(df[period].index+bw_n-0.3, df[period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+        return self
 
+    @instrumented
+    def to_cube(self):
 
-        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
-
-        ax.set_ylabel(r'VG[CO$_2$]$_{[time]}$/ff$_{emissions}$$_{[time]}$' "\n" r'$\regular_{(ppm/m) * (mol/h * 10^{8})^{-1} }$', fontsize=75)
-
-
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
-        
-    ax.legend(fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
-
-# vertical gradient normalized by ff emissions categorized by turbulent kinetic energy
+        cube = {}
+        medians = self._medians()
+        for var in self.values:
+            for stat in ['count', 'sum', 'sumsq']:
+                cube[var, stat] = self.moments[var, stat]
+            cube[var, 'median'] = medians.get(var, pd.Series(dtype = float)).reindex(self.moments.index)
+        cube = _cube_moments(pd.DataFrame(cube), self.values)
+
+        for var in self.values:
+            for stat in ['min', 'max']:
+                cube[var, stat] = self.moments[var, stat]
+        columns = [(var, stat) for var in self.values for stat in CUBE_STATS + ['min', 'max']]
 
-def fig_VGFF_tke(df, var, periods_list,gas):
-    fig, ax = plt.subplots(figsize=(35, 20))
-    bw = 1/11 #barwidth is the distance from the center divided by the # of sites
-    bw_n = 0
-    i = 0
-    n = 2*len(periods_list) #len(seasons)
-    x = ['','<1.0','','1.0-1.2','','1.2-1.4','','1.4-1.6','','>1.6','']
+        return cube.reindex(columns = pd.MultiIndex.from_tuples(columns)).sort_index()
+
+    def save(self, path):
+
+        pd.to_pickle({'values': self.values, 'by': self.by, 'resolution': self.resolution, 'moments': self.moments,
+                      'sketch': self.sketch, 'last_hour': self.last_hour}, path)
+
+    @classmethod
+    def load(cls, path):
+
+        state = pd.read_pickle(path)
+        running = cls(state['values'], state['by'], state['resolution'])
+        running.moments, running.sketch, running.last_hour = state['moments'], state['sketch'], state['last_hour']
+
+        return running
+
+    # rows newer than the last hour seen, and the watermarks they move forward (SITE -> last hour)
+    def _new_rows(self, df):
+
+        times = df.index.get_level_values('datetime_utc') if isinstance(df.index, pd.MultiIndex) else df.index
+        if 'SITE' in df.columns:
+            sites = np.asarray(df['SITE'])
+        elif 'SITE' in df.index.names:
+            sites = np.asarray(df.index.get_level_values('SITE'))
+        else:
+            sites = np.full(len(df), None)
+
+        keep = np.ones(len(df), dtype = bool)
+        last_hour = {}
+        for site in pd.unique(sites):
+            rows = sites == site
+            if site in self.last_hour:
+                keep[rows] = times[rows] > self.last_hour[site]
+            if (keep & rows).any():
+                last_hour[site] = times[keep & rows].max()
+
+        return keep, last_hour
+
+    def _merge_moments(self, old, new):
+
+        both = pd.concat([old, new])
+        levels = list(range(both.index.nlevels))
+        merged = {}
+        for var in self.values:
+            for stat, how in [('count', 'sum'), ('sum', 'sum'), ('sumsq', 'sum'), ('min', 'min'), ('max', 'max')]:
+                merged[var, stat] = both[var, stat].groupby(level = levels).agg(how)
+
+        return pd.DataFrame(merged)
+
+    # medians from the histograms: mean of the two middle ranks, like np.median
+    def _medians(self):
+
+        sketch = self.sketch.sort_index()
+        groups = self.by + ['VAR']
+        upper = sketch.groupby(level = groups, observed = True).cumsum()
+        lower = upper - sketch
+        n = sketch.groupby(level = groups, observed = True).transform('sum')
+
+        buckets = sketch.index.get_level_values('BUCKET').to_numpy() * self.resolution
+        frame = pd.DataFrame({'VALUE': buckets}, index = sketch.index)
+        mid_low = (lower <= (n-1)//2) & ((n-1)//2 < upper)
+        mid_high = (lower <= n//2) & (n//2 < upper)
+        low = frame.loc[mid_low.to_numpy()].droplevel('BUCKET')['VALUE']
+        high = frame.loc[mid_high.to_numpy()].droplevel('BUCKET')['VALUE']
+        medians = (low + high) / 2
+
+        return {var: medians.xs(var, level = 'VAR') for var in self.values
+                if var in medians.index.get_level_values('VAR')}
+
+## Bootstrap confidence intervals for the cells of `by` (e.g. ['SITE', 'SEASON', 'PERIOD', 'WS_OBS_CAT'])
+# Block bootstrap by day: a replicate draws the UTC days of the data with replacement (within each
+# value of `strata`, e.g. 'SEASON', when given) and keeps every row of the drawn days, for all sites at
+# once, so autocorrelation within a day and between sites is kept. Means (also bias and MAE: the means
+# of Error and ABS_Error) come from per-day sums as one matrix product per batch of replicates, and
+# medians from weighted medians of the sorted values of each cell. Batches of replicates are spread
+# over a process pool (workers > 1); each batch has its own seed spawned from `seed`, so results
+# do not depend on the number of workers.
+# Returns a frame indexed by (*by, VARIABLE, STAT) with N, ESTIMATE, LOW, HIGH (percentile interval
+# at `level`) and SE (standard deviation of the replicates).
+
+BOOTSTRAP_STATS = ['mean', 'median']
+
+@instrumented
+def bootstrap_cells(df, values, by, stats = BOOTSTRAP_STATS, n_boot = 1000, level = 0.95, strata = None,
+                    seed = 0, workers = 1, batch = 100):
+
+    values = [values] if isinstance(values, str) else list(values)
+    by = [by] if isinstance(by, str) else list(by)
+    stats = [stats] if isinstance(stats, str) else list(stats)
+    data = _bootstrap_data(df, values, by, strata)
+
+    sizes = [min(batch, n_boot - start) for start in range(0, n_boot, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    try:
+        if workers > 1 and len(sizes) > 1:
+            with ProcessPoolExecutor(max_workers = workers, initializer = _bootstrap_init, initargs = (data, stats)) as pool:
+                replicates = list(pool.map(_bootstrap_batch, seeds, sizes))
+        else:
+            _bootstrap_init(data, stats)
+            replicates = [_bootstrap_batch(s, size) for s, size in zip(seeds, sizes)]
+    finally:
+        _BOOTSTRAP.clear() # the serial path keeps no reference to the data after the call
+
+    rows = []
+    for stat in stats:
+        reps = np.concatenate([r[stat] for r in replicates]) # replicates x cells x values
+        estimate = data['estimates'][stat]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category = RuntimeWarning) # cells without data in some replicates
+            low, high = np.nanquantile(reps, [(1 - level)/2, (1 + level)/2], axis = 0)
+            se = np.nanstd(reps, axis = 0, ddof = 1)
+        for k, var in enumerate(values):
+            rows.append(pd.DataFrame({'N': data['counts'][:, k].astype(np.int64), 'ESTIMATE': estimate[:, k], 'LOW': low[:, k],
+                                      'HIGH': high[:, k], 'SE': se[:, k], 'VARIABLE': var, 'STAT': stat},
+                                     index = data['cells']))
+
+    table = pd.concat(rows).set_index(['VARIABLE', 'STAT'], append = True)
+    return table.loc[table['N'] > 0].sort_index()
+
+
+# per-day sums and counts (days x cells x values) and, for the medians, the values of each cell
+# sorted, with the day of each value; days are numbered within strata
+def _bootstrap_data(df, values, by, strata):
+
+    grouped = pd.Series(0, index = df.index).groupby(_group_keys(df, by), observed = True)
+    cell = grouped.ngroup().fillna(-1).to_numpy(dtype = np.int64)
+    cells = grouped.size().index
+    n_cells = len(cells)
+
+    times = df.index.get_level_values('datetime_utc') if 'datetime_utc' in (df.index.names or []) else df.index
+    times = pd.DatetimeIndex(times)
+    times = times.tz_convert('UTC') if times.tz is not None else times
+    day_codes, days = pd.factorize(times.floor('D'), sort = True)
+    if strata is None:
+        day_strata = np.zeros(len(days), dtype = int)
+    else:
+        stratum = np.asarray(_group_keys(df, [strata])[0]).astype(str)
+        first = pd.Series(stratum).groupby(day_codes).first()
+        day_strata = pd.factorize(first.to_numpy())[0]
+
+    sums = np.zeros((len(days), n_cells, len(values)))
+    counts = np.zeros((len(days), n_cells, len(values)))
+    sorted_values, sorted_days, offsets = [], [], np.zeros((n_cells, len(values), 2), dtype = np.int64)
+    position = 0
+    for k, var in enumerate(values):
+        x = df[var].to_numpy(dtype = float)
+        valid = np.isfinite(x) & (cell >= 0)
+        key = day_codes[valid]*n_cells + cell[valid]
+        sums[:, :, k] = np.bincount(key, weights = x[valid], minlength = len(days)*n_cells).reshape(len(days), n_cells)
+        counts[:, :, k] = np.bincount(key, minlength = len(days)*n_cells).reshape(len(days), n_cells)
+
+        order = np.lexsort((x[valid], cell[valid]))
+        cell_sorted = cell[valid][order]
+        sorted_values.append(x[valid][order])
+        sorted_days.append(day_codes[valid][order])
+        bounds = np.searchsorted(cell_sorted, np.arange(n_cells + 1))
+        offsets[:, k, 0] = position + bounds[:-1]
+        offsets[:, k, 1] = position + bounds[1:]
+        position += len(order)
+
+    sorted_values = np.concatenate(sorted_values)
+    total = counts.sum(axis = 0)
+    estimates = {'mean': sums.sum(axis = 0) / np.where(total > 0, total, np.nan),
+                 'median': np.array([[np.median(sorted_values[a:b]) if b > a else np.nan for a, b in row]
+                                     for row in offsets])}
+
+    return {'cells': cells, 'day_strata': day_strata, 'sums': sums.reshape(len(days), -1),
+            'counts_by_day': counts.reshape(len(days), -1), 'counts': total, 'estimates': estimates,
+            'values': sorted_values, 'days': np.concatenate(sorted_days), 'offsets': offsets}
+
+
+_BOOTSTRAP = {}
+
+def _bootstrap_init(data, stats):
+
+    _BOOTSTRAP['data'] = data
+    _BOOTSTRAP['stats'] = stats
+
+
+# one batch of replicates: {stat: replicates x cells x values}
+def _bootstrap_batch(seed_sequence, size):
+
+    data = _BOOTSTRAP['data']
+    rng = np.random.default_rng(seed_sequence)
+    n_days = len(data['day_strata'])
+    n_cells, n_values = data['offsets'].shape[:2]
+
+    # number of times each day is drawn in each replicate, day draws stay within their stratum
+    weights = np.zeros((size, n_days))
+    for stratum in np.unique(data['day_strata']):
+        members = np.flatnonzero(data['day_strata'] == stratum)
+        draws = members[rng.integers(0, len(members), (size, len(members)))]
+        weights += np.bincount((draws + n_days*np.arange(size)[:, None]).ravel(),
+                               minlength = size*n_days).reshape(size, n_days)
+
+    out = {}
+    if 'mean' in _BOOTSTRAP['stats']:
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            out['mean'] = (weights @ data['sums'] / (weights @ data['counts_by_day'])).reshape(size, n_cells, n_values)
+    if 'median' in _BOOTSTRAP['stats']:
+        medians = np.full((size, n_cells, n_values), np.nan)
+        for c in range(n_cells):
+            for k in range(n_values):
+                a, b = data['offsets'][c, k]
+                if b > a:
+                    medians[:, c, k] = _weighted_medians(data['values'][a:b], weights[:, data['days'][a:b]])
+        out['median'] = medians
+
+    return out
+
+
+# median of sorted values repeated by integer weights (replicates x values), as np.median would give
+def _weighted_medians(values, weights):
+
+    cum = np.cumsum(weights, axis = 1)
+    total = cum[:, -1]
+    low = np.minimum((cum <= ((total - 1) // 2)[:, None]).sum(axis = 1), len(values) - 1)
+    high = np.minimum((cum <= (total // 2)[:, None]).sum(axis = 1), len(values) - 1)
+
+    return np.where(total > 0, (values[low] + values[high]) / 2, np.nan)
+
+
+# bootstrap intervals as error bars: (ESTIMATE - LOW, HIGH - ESTIMATE) tables laid out as cube_table,
+# e.g. ci_yerr(ci, 'VG', 'median', SITE='SITE02', SEASON='DORMANT'), for the yerr of the fig_* functions;
+# with index = None the cells left after fixing are a series (e.g. by PERIOD for fig_xs_diff)
+@instrumented
+def ci_yerr(ci, var, stat = 'mean', index = 'WS_OBS_CAT', columns = 'PERIOD', **fixed):
+
+    table = ci.xs((var, stat), level = ['VARIABLE', 'STAT'])
+    for level, value in fixed.items():
+        table = table.xs(value, level = level)
+    lower = table['ESTIMATE'] - table['LOW']
+    upper = table['HIGH'] - table['ESTIMATE']
+
+    return (lower, upper) if index is None else (lower.unstack(columns), upper.unstack(columns))
 
-       
 
-    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+#--------------------------------------------------------------------------------------------------------------------------
 
-    for period in periods_list: 
+### plots (figures)
 
-        if period == '12-4 PM LT':
-            hatch_period = 'X'
-        if period != '12-4 PM LT':
-            hatch_period = None
+# Lazy figures: functions decorated with @figure_spec take spec = True to return a FigureSpec
+# (the function name, its data and arguments, and rcParams overrides) instead of drawing.
+# render_figures draws and saves a batch of specs with the Agg backend, in a process pool when workers > 1,
+# and skips specs whose hash (data, arguments and source of the figure function and of its module) is unchanged since the last run.
+# e.g. specs = {'vg_norm_ws': fig_vg_norm_time_ws(df, periods_list, 'co2', spec = True), ...}
+#      render_figures(specs, 'FIGURES', workers = 4)
 
-        ax.bar(df[period].index+bw_n-0.3, df[period], 
-                yerr=0, ecolor='black',width = bw, 
-                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
-                alpha = 1, color = my_colors[i], hatch = hatch_period, 
-                label = period ) 
+FIGURE_FUNCTIONS = {}
+FIGURE_MANIFEST = 'figure_manifest.json' # written in the output directory of render_figures
 
 
-        ax.set_xlabel('TKE (m$^2$/s$^2$)', fontsize=95)
+def figure_spec(func):
+
+    @functools.wraps(func)
+    def wrapper(*args, spec = False, style = None, **kwargs):
+        if spec:
+            return FigureSpec(func.__module__, func.__name__, args, kwargs, style)
+        return func(*args, **kwargs)
+
+    FIGURE_FUNCTIONS[func.__module__, func.__name__] = func
+    return wrapper
+
+
+class FigureSpec:
+
+    def __init__(self, module, name, args, kwargs = None, style = None):
+
+        self.module = module
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.style = style or {}
+
+    def __repr__(self):
+        return 'FigureSpec(%s)' % self.name
+
+    def data_hash(self):
+
+        digest = hashlib.sha1()
+        digest.update(_function_source(self.module, self.name).encode())
+        digest.update(_module_source(self.module).encode()) # helpers and constants the function uses (grouped_bars, wind_store, build_store...)
+        for value in list(self.args) + sorted(self.kwargs.items()) + sorted(self.style.items()):
+            _hash_value(digest, value)
+        return digest.hexdigest()
+
+    # draw the figure(s); returns the list of new figures
+    def draw(self):
+
+        import matplotlib.pyplot as plt
+        __import__(self.module) # registers the figure functions of that module
+        func = FIGURE_FUNCTIONS[self.module, self.name]
+        before = set(plt.get_fignums())
+        with plt.rc_context(self.style):
+            func(*self.args, **self.kwargs)
+        return [plt.figure(num) for num in plt.get_fignums() if num not in before]
+
+    # draw and save as stem.fmt (stem_1.fmt, stem_2.fmt, ... for functions that draw several figures)
+    def save(self, stem, fmt = 'png', dpi = None):
+
+        import matplotlib.pyplot as plt
+        figures = self.draw()
+        paths = []
+        for n, fig in enumerate(figures):
+            path = stem + ('_%d' % (n+1) if len(figures) > 1 else '') + '.' + fmt
+            fig.savefig(path, format = fmt, dpi = dpi)
+            plt.close(fig)
+            paths.append(path)
+        return paths
+
 
-        ax.set_ylabel(r'VG[CO$_2$]$_{[time]}$/ff$_{emissions}$$_{[time]}$' "\n" r'$\regular_{(ppm/m) * (mol/h * 10^{8})^{-1} }$', fontsize=75)
-            #ax.set_ylim(-1.7,0)
-            
+@functools.lru_cache(maxsize = None)
+def _function_source(module, name):
 
-        # fixing yticks with matplotlib.ticker "FixedLocator"
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels(x)
-        ax.tick_params(axis = 'both',labelsize = 95)    
-        ax.grid(axis = 'y',alpha = 1)
-        bw_n = bw_n+bw
-        i += 1
+    __import__(module)
+    return inspect.getsource(FIGURE_FUNCTIONS[module, name])
 
-    ax.legend(fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
-    return ax
 
+# source of the module and of every module next to this file that it uses, directly or through
+# other such modules (e.g. Wind_Cities and Add_Data_Functions for wind_by_cities)
+@functools.lru_cache(maxsize = None)
+def _module_source(module):
 
-# wind speed model vs obs
-def ws_mod_ob(df,season):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    todo, used = [__import__(module)], {}
+    while todo:
+        mod = todo.pop()
+        if mod.__name__ in used:
+            continue
+        used[mod.__name__] = mod
+        for value in vars(mod).values():
+            name = getattr(value, '__module__', None)
+            other = value if inspect.ismodule(value) else sys.modules.get(name) if isinstance(name, str) else None
+            path = getattr(other, '__file__', None)
+            if path and os.path.dirname(os.path.abspath(path)) == folder:
+                todo.append(other)
 
-    from sklearn.metrics import r2_score
+    return ''.join(inspect.getsource(used[name]) for name in sorted(used))
 
-    lg_labels = [ '00:00 - 04:59','05:00 - 08:59','09:00 - 11:59', '12:00 - 16:59',
-                 '17:00 - 20:59','21:00 - 23:59']
 
-    i=0
-    for key in [ '0-4 AM LT','5-8 AM LT','9-11 AM LT', '12-4 PM LT', '5-8 PM LT','9-11 PM LT']:
-        fig, ax4 = plt.subplots(figsize=(20, 20)) #PLOT OF VERTICAL GRADIENTS VS BLD CATEGORIES
+def _hash_value(digest, value):
 
-        xx = df['WS_OBS'].loc[(df['PERIOD'] == key)&(df['SEASON'] == season)]
-        yy = df['WRF_WS'].loc[(df['PERIOD'] == key)&(df['SEASON'] == season)]
-        idx = np.isfinite(xx) & np.isfinite(yy)
-        m,b = np.polyfit(xx[idx], yy[idx], 1)
-        r = np.corrcoef(xx[idx], yy[idx])
-        ax4.plot(xx,
-                 yy, 'o', color = 'black',
-                 markersize= 20, linewidth=5, label = lg_labels[i])
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(value.columns.tolist() if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index = True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'(')
+        for item in value:
+            _hash_value(digest, item)
+        digest.update(b')')
+    elif isinstance(value, dict):
+        _hash_value(digest, sorted(value.items()))
+    else:
+        digest.update(repr(value).encode())
 
-        ax4.plot(xx, m*xx + b, "r-", lw=5, label = 'r$^2$ = '+str(r[1,0].round(2)))
-        ax4.axline((0, 0), slope=1, linestyle = '-.',lw=3, color = 'black', label = '1:1')
 
+# specs = {file name without extension: FigureSpec}
+# returns {file name: list of files written}, empty for skipped specs (force = True renders everything)
+@instrumented
+def render_figures(specs, outdir, workers = 1, fmt = 'png', dpi = None, force = False):
 
-        ax4.set_xlabel(r'Observed wind speed (m/s)', fontsize=95)
-        ax4.set_ylabel(r'Modeled wind speed (m/s)', fontsize=95)
-        ax4.set_ylim(-0.1,20)
-        ax4.set_xlim(-0.1,20)
-        ax4.legend(loc = 'best',fontsize =45)
-        ax4.tick_params(axis = 'both',labelsize = 95) 
-        i = i+1
+    os.makedirs(outdir, exist_ok = True)
+    manifest_path = os.path.join(outdir, FIGURE_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # manifest entries are per file name and format, so png and pdf runs do not invalidate each other
+    hashes = {name: spec.data_hash() + ':' + str(dpi) for name, spec in specs.items()}
+    entries = {name: name + '.' + fmt for name in specs}
+    todo = [name for name in specs if force or manifest.get(entries[name], {}).get('hash') != hashes[name]
+            or not all(os.path.exists(path) for path in manifest[entries[name]]['files'])]
+    stems = [os.path.join(outdir, name) for name in todo]
+
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers = workers, initializer = _render_init) as pool:
+            written = list(pool.map(_render_spec, [specs[name] for name in todo], stems,
+                                    [fmt]*len(todo), [dpi]*len(todo)))
+    else:
+        written = [_render_spec(specs[name], stem, fmt, dpi) for name, stem in zip(todo, stems)]
 
-        print(key,': y=',m.round(2),'x +',b.round(2))
-        
-    return ax4
+    for name, paths in zip(todo, written):
+        manifest[entries[name]] = {'hash': hashes[name], 'files': paths}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+
+    rendered = dict(zip(todo, written))
+    return {name: rendered.get(name, []) for name in specs}
 
-# wind speed residuals
-def fig_ws_bias(df, season): #DATA['WSP']
-    i=0
-    
-    lg_labels = [ '00:00 - 04:59','05:00 - 08:59','09:00 - 11:59', '12:00 - 16:59',
-             '17:00 - 20:59','21:00 - 23:59']
-    
-    for key in [ '0-4 AM LT','5-8 AM LT','9-11 AM LT', '12-4 PM LT', '5-8 PM LT','9-11 PM LT']:
-        fig, ax = plt.subplots(figsize=(20, 20)) #PLOT OF VERTICAL GRADIENTS VS BLD CATEGORIES
 
-        
-        #wind speed < 5 m/s (equivalent to wsp category 0 to 3 as defined at the beginning of the code)
-        temp = df.loc[(df['WS_OBS_CAT']<4)&(df['PERIOD'] == key)&(df['SEASON'] == season)]
-        WSP_l5 = temp['Error'].mean()
+# pool workers draw off-screen; the serial path keeps the caller's backend (e.g. in a notebook)
+def _render_init():
 
-        # wind speed >= 5 m/s (equivalent to wsp category >= 4 as defined at the beginning of the code)
-        temp = df.loc[(df['WS_OBS_CAT']>=4)&(df['PERIOD'] == key)&(df['SEASON'] == season)]
-        WSP_g5 = temp['Error'].mean()
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
 
 
-        
-        xx2 = df.loc[(df['WS_OBS_CAT']<4)&(df['PERIOD'] == key)&(df['SEASON']==season)].index
-        yy2 = df['Error'].loc[(df['WS_OBS_CAT']<4)&(df['PERIOD'] == key) &(df['SEASON']==season)]
+def _render_spec(spec, stem, fmt, dpi):
 
-        xx1 = df.loc[(df['WS_OBS_CAT']>=4)&(df['PERIOD'] == key)&(df['SEASON']==season)].index
-        yy1 = df['Error'].loc[(df['WS_OBS_CAT']>=4)&(df['PERIOD'] == key) &(df['SEASON']==season)]
+    return spec.save(stem, fmt, dpi)
 
-        ax.plot(xx1,
-                 yy1, 'o', color = 'black', 
-                 markersize= 20, linewidth=5, label = r'$\geq$ 5 m/s')
 
-        ax.plot(xx2,
-                 yy2, 'o', color = 'black', 
-                 alpha = 0.3, markersize= 20, linewidth=5, label = r'< 5 m/s')
+## Figures: grouped bars and the fig_* functions are in Add_Data_Plots.py, imported on first use
+# (adf.fig_vg_time_ws, from Add_Data_Functions import fig_xs_ws, or import *) so that the readers,
+# categories and tables load without matplotlib.
 
-        ax.axhline(y=WSP_g5, color = 'k', linestyle = '-.',
-                    linewidth = 4, label = r'Mean bias ($\geq$ 5m/s) =' +str(WSP_g5.round(1)))
+PLOT_NAMES = ['plt', 'mdates', 'mticker', 'BAR_COLORS', 'BAR_HATCH', 'BAR_AXES', 'VG_TIME_LINES',
+              'BLD_RBIAS_LINES', 'grouped_bars', 'VG_TIME_LABELS', 'VG_EM_LABEL', 'BLD_RBIAS_LABEL',
+              'VGFF_LABEL', 'XS_LABELS', 'fig_vg_norm_time_ws', 'fig_vg_time_tke', 'fig_vg_time_emis_ws',
+              'fig_vg_time_emis_tke', 'fig_bld_RBias', 'fig_bld_RBias_tke', 'fig_bld_Bias', 'fig_xs_ws',
+              'fig_xs_tke', 'fig_xs_diff', 'fig_vg_time_ws', 'fig_VGFF_ws', 'fig_VGFF_tke', 'ws_mod_ob',
+              'fig_ws_bias']
 
-        ax.axhline(y=WSP_l5, color = 'k', linestyle = '-.',alpha =0.3,
-                    linewidth = 4, label = r'Mean bias (< 5m/s) =' +str(WSP_l5.round(1)))
 
+def __getattr__(name):
 
+    if name in PLOT_NAMES:
+        import Add_Data_Plots
+        return getattr(Add_Data_Plots, name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
-        ax.set_ylabel(r'Wind speed bias (m/s)', fontsize=95)
-        ax.set_ylim(-6.5,6.5)
-        ax.legend(loc = 'best',fontsize =35, title = lg_labels[i], title_fontsize = 45)
-        ax.tick_params(axis = 'y',labelsize = 95) 
-        ax.tick_params(axis = 'x',labelsize = 55, rotation = 30) 
-        plt.grid(alpha=0.5)
-        i = i+1
 
-    return fig
-    
 #--------------------------------------------------------------------------------------------------------
 
 #### TABLE
+
+# mean absolute error and mean bias (model - obs) of paired observed and modeled values
+# (mean_absolute_error gives the same as sklearn.metrics.mean_absolute_error)
+def mean_absolute_error(y_true, y_pred):
+
+    return float(np.mean(np.abs(np.asarray(y_pred, dtype = float) - np.asarray(y_true, dtype = float))))
+
+
+def mean_bias(y_true, y_pred):
+
+    return float(np.mean(np.asarray(y_pred, dtype = float) - np.asarray(y_true, dtype = float)))
+
+
+@instrumented
 def table_mae_bias(df_in, var_obs, var_model, periods_list):
 
-    from sklearn.metrics import mean_absolute_error as mae
     Errors = pd.DataFrame(index= periods_list, columns = ['N','MEAN','MAE','BIAS'])
 
 
@@ -946,13 +1726,105 @@ def table_mae_bias(df_in, var_obs, var_model, periods_list):
         y_pred = y_copy[var_model]
 
 
-        bias = (y_pred.sum() - y_true.sum())/len(y_true) #BIAS
-        error = mae(y_true,y_pred ) #MAE
+        bias = mean_bias(y_true, y_pred) #BIAS
+        error = mean_absolute_error(y_true, y_pred) #MAE
 
 
-        Errors.loc[key]['MAE'] = error.round(1) 
-        Errors.loc[key]['BIAS'] = bias.round(1) 
+        Errors.loc[key]['MAE'] = np.round(error, 1)
+        Errors.loc[key]['BIAS'] = np.round(bias, 1) 
         Errors.loc[key]['MEAN'] = df[var_obs].mean().round(1) 
         Errors.loc[key]['N'] = len(y_pred)   # NUMBER OF POINTS
 
     return Errors
+
+
+# table_mae_bias from a cube built with stat_cube(df, ['Error', 'ABS_Error', var_obs], by) where by
+# includes PERIOD; other levels are fixed with keyword arguments or merged
+@instrumented
+def table_mae_bias_cube(cube, var_obs, periods_list, **fixed):
+
+    for level, value in fixed.items():
+        cube = cube.xs(value, level = level)
+    cube = cube_collapse(cube, 'PERIOD').reindex(periods_list)
+
+    Errors = pd.DataFrame(index= pd.Index(periods_list, name = 'PERIOD'), columns = ['N','MEAN','MAE','BIAS'])
+    Errors['N'] = cube['Error', 'count'].to_numpy()
+    Errors['MEAN'] = cube[var_obs, 'mean'].round(1).to_numpy()
+    Errors['MAE'] = cube['ABS_Error', 'mean'].round(1).to_numpy()
+    Errors['BIAS'] = cube['Error', 'mean'].round(1).to_numpy()
+
+    return Errors
+
+
+# table_mae_bias_cube with bootstrap intervals, from bootstrap_cells(df, ['Error', 'ABS_Error', var_obs],
+# by, 'mean', ...) where by includes PERIOD; other levels are fixed with keyword arguments
+@instrumented
+def table_mae_bias_ci(ci, var_obs, periods_list, **fixed):
+
+    ci = ci.xs('mean', level = 'STAT')
+    for level, value in fixed.items():
+        ci = ci.xs(value, level = level)
+    cell = lambda var: ci.xs(var, level = 'VARIABLE').reindex(periods_list)
+
+    Errors = pd.DataFrame(index= pd.Index(periods_list, name = 'PERIOD'))
+    Errors['N'] = cell('Error')['N'].to_numpy()
+    Errors['MEAN'] = cell(var_obs)['ESTIMATE'].round(1).to_numpy()
+    for name, var in (('MAE', 'ABS_Error'), ('BIAS', 'Error')):
+        for column, stat in ((name, 'ESTIMATE'), (name + '_LOW', 'LOW'), (name + '_HIGH', 'HIGH')):
+            Errors[column] = cell(var)[stat].round(1).to_numpy()
+
+    return Errors
+
+
+## Model vs observation regression
+# Least-squares fit model = SLOPE * obs + INTERCEPT with N, R, R2 and RMSE (of model - obs) for every
+# group of `by` (columns or index levels, e.g. ['SITE', 'SEASON', 'PERIOD']) and every pair of
+# pairs = {variable: (obs column, model column)}, e.g. {'WS': ('WS_OBS', 'WRF_WS'), 'ABL': ('LidarABL', 'ModelABL')}.
+# Rows where obs or model is missing are left out of that pair. All groups and pairs come from one
+# groupby of the sums (n, x, y, xy, x^2, y^2); x and y are centred on their overall means first so
+# the sums keep their precision for values far from zero (e.g. CO2 in ppm).
+# Returns a tidy frame indexed by (*by, VARIABLE).
+
+REGRESSION_SUMS = ['n', 'x', 'y', 'xy', 'xx', 'yy', 'dd']
+
+@instrumented
+def regression_table(df, pairs, by):
+
+    by = [by] if isinstance(by, str) else list(by)
+
+    sums = {}
+    shifts = {}
+    for var, (obs, model) in pairs.items():
+        x = df[obs].to_numpy(dtype = float)
+        y = df[model].to_numpy(dtype = float)
+        valid = np.isfinite(x) & np.isfinite(y)
+        shifts[var] = (x[valid].mean(), y[valid].mean()) if valid.any() else (0.0, 0.0)
+        x = np.where(valid, x - shifts[var][0], 0.0)
+        y = np.where(valid, y - shifts[var][1], 0.0)
+        d = np.where(valid, df[model].to_numpy(dtype = float) - df[obs].to_numpy(dtype = float), 0.0)
+        for name, values in zip(REGRESSION_SUMS, [valid.astype(float), x, y, x*y, x*x, y*y, d*d]):
+            sums[var, name] = values
+
+    sums = pd.DataFrame(sums, index = df.index).groupby(_group_keys(df, by), observed = True).sum()
+    sums = sums.stack(level = 0)
+    sums.index = sums.index.set_names(by + ['VARIABLE'])
+
+    n = sums['n']
+    sxx = sums['xx'] - sums['x']**2 / n
+    syy = sums['yy'] - sums['y']**2 / n
+    sxy = sums['xy'] - sums['x']*sums['y'] / n
+    slope = sxy / sxx.where(sxx > 0)
+    r = sxy / np.sqrt((sxx*syy).where((sxx > 0) & (syy > 0)))
+
+    variable = sums.index.get_level_values('VARIABLE')
+    x_shift = np.array([shifts[v][0] for v in variable])
+    y_shift = np.array([shifts[v][1] for v in variable])
+    intercept = (sums['y'] - slope*sums['x']) / n + y_shift - slope*x_shift
+
+    table = pd.DataFrame({'N': n.astype(int), 'SLOPE': slope, 'INTERCEPT': intercept, 'R': r, 'R2': r**2,
+                          'RMSE': np.sqrt(sums['dd'] / n.where(n > 0))})
+    return table.loc[table['N'] > 0].sort_index()
+
+
+# `from Add_Data_Functions import *` also gives the figure functions (loads Add_Data_Plots)
+__all__ = [name for name in list(globals()) if not name.startswith('_')] + PLOT_NAMES
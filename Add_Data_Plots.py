@@ -0,0 +1,318 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import pandas as pd
+import matplotlib.dates as mdates
+import matplotlib.ticker as mticker
+from Add_Data_Functions import PERIOD_HOURS, figure_spec, instrumented, regression_table
+
+"""
+Figures of the paper (grouped bars by wind speed / TKE category, wind speed model vs observation).
+Split from Add_Data_Functions.py so that the readers, categories and tables load without matplotlib:
+Add_Data_Functions imports this module on the first use of one of its names (PLOT_NAMES there),
+so `from Add_Data_Functions import *` and adf.fig_vg_time_ws(...) keep working.
+
+"""
+
+
+## grouped bars: one bar series per period over the categories of the x axis
+
+BAR_COLORS = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+BAR_HATCH = {'12-4 PM LT': 'X'}
+
+# category axes: x label, tick labels (one per category code) and bar width
+BAR_AXES = {'ws': {'xlabel': 'Wind Speed (m/s)', 'labels': ['<2','2-3','3-4','4-5','5-6','>6'], 'width': 1/7.5},
+            'tke': {'xlabel': 'TKE (m$^2$/s$^2$)', 'labels': ['<1.0','1.0-1.2','1.2-1.4','1.4-1.6','>1.6'], 'width': 1/11}}
+
+# reference lines of the normalized vertical gradient and BLD relative bias figures
+VG_TIME_LINES = [dict(y = 2.5, color = 'r', label = '2.5x afternoon'), dict(y = 1, color = 'k', label = '1.0x afternoon')]
+BLD_RBIAS_LINES = [dict(y = 30, color = 'r', label = r'$\pm$30%'), dict(y = -30, color = 'r')]
+
+
+# df: one column per period, indexed by category code; axis is a key of BAR_AXES or a dict like its values.
+# Every period is one bar call, labels, limits and ticks are set once after all periods are drawn.
+@instrumented
+def grouped_bars(df, periods_list, axis, ylabel = None, ylabel_size = 95, ylim = None, xlim = None,
+                 lines = (), legend_loc = 'upper right', figsize = (35, 20), yerr = None):
+
+    axis = BAR_AXES[axis] if isinstance(axis, str) else axis
+    bw = axis['width'] #barwidth is the distance from the center divided by the # of sites
+
+    fig, ax = plt.subplots(figsize = figsize)
+    for i, period in enumerate(periods_list):
+        series = df[period]
+        ax.bar(np.asarray(series.index, dtype = float) + i*bw - 0.3, series.to_numpy(dtype = float),
+               width = bw, edgecolor = 'black', linewidth = 5, color = BAR_COLORS[i % len(BAR_COLORS)],
+               hatch = BAR_HATCH.get(period), label = period, yerr = _bar_yerr(yerr, period, series.index),
+               ecolor = 'black', error_kw = dict(lw = 8, capsize = 100*bw, capthick = 3))
+
+    ax.set_xlabel(axis['xlabel'], fontsize = 95)
+    if ylabel is not None:
+        ax.set_ylabel(ylabel, fontsize = ylabel_size)
+    if ylim is not None:
+        ax.set_ylim(*ylim)
+    ax.set_xticks(range(len(axis['labels'])), axis['labels'])
+    if xlim is not None:
+        ax.set_xlim(*xlim)
+    ax.tick_params(axis = 'both', labelsize = 95)
+    ax.grid(axis = 'y', alpha = 1)
+
+    for line in lines:
+        ax.axhline(**dict(dict(linestyle = '-.', linewidth = 4), **line))
+    ax.legend(loc = legend_loc, fontsize = 45, title = 'Local time (LT)', title_fontsize = 45)
+    return ax
+
+
+# error bars of one period (or of a series when period is None): yerr is a table like df (symmetric)
+# or a (lower, upper) pair of them (ci_yerr)
+def _bar_yerr(yerr, period, index):
+
+    if yerr is None:
+        return None
+    if isinstance(yerr, tuple):
+        return np.vstack([_bar_yerr(e, period, index) for e in yerr])
+
+    table = yerr if period is None else yerr[period]
+    if not isinstance(table, (pd.Series, pd.DataFrame)):
+        return table # a number or an array already in bar order
+    return table.reindex(index).to_numpy(dtype = float)
+
+
+VG_TIME_LABELS = {'co2': r'$\widetilde{VG}[$CO$_2$]$_{[time]}$', 'ch4': r'$\widetilde{VG}[$CH$_4$]$_{[time]}$'}
+VG_EM_LABEL = r'$\widetilde{VG}[$CO$_2$]$_{[time;emission]}$'
+BLD_RBIAS_LABEL = r'BLD bias$_{[time]}$ (%)'
+# ff_rel: the relative (dimensionless) season x period emission factors of EMISSIONS, not mol/h
+VGFF_LABEL = r'VG[CO$_2$]$_{[time]}$/ff$_{rel}$$_{[time]}$' "\n" r'$\regular_{(ppm/m), ff\ emissions\ normalized}$'
+
+# enhancement variables: y label, label size and limits on the wind speed / TKE axes
+XS_LABELS = {'XS': (r'CO$_2$ xs$_{obs}$ (ppm)', 95, (0,15), (0,15)),
+             'XS_MODEL': (r'CO$_2$ xs$_{model}$ (ppm)', 95, (0,15), (0,15)),
+             'XS_FF_BLD': (r'CO$_2$ xs$_{obs}$/ff$_{rel}$/BLD$_{obs}$' "\n" r'$\regular_{(ppm/m), ff\ emissions\ normalized}$', 75, (0,0.4), (0,0.22)),
+             'XSModel_FF_BLD': (r'CO$_2$ xs$_{model}$/ff$_{rel}$/BLD$_{model}$' "\n" r'$\regular_{(ppm/m), ff\ emissions\ normalized}$', 75, (0,0.4), (0,0.22))}
+
+
+# vertical gradient normalized by time and categorized by wind speed
+
+@figure_spec
+@instrumented
+def fig_vg_norm_time_ws(df, periods_list,gas, yerr = None):
+    return grouped_bars(df['VG'], periods_list, 'ws', VG_TIME_LABELS.get(gas), ylim = (0,32), lines = VG_TIME_LINES, yerr = yerr)
+
+
+# vertical gradient normalized by time and categorized by turbulent kinetic energy
+@figure_spec
+@instrumented
+def fig_vg_time_tke(df, periods_list,gas, yerr = None):
+    return grouped_bars(df['VG'], periods_list, 'tke', VG_TIME_LABELS.get(gas), ylim = (0,15), lines = VG_TIME_LINES, yerr = yerr)
+
+
+# vertical gradient normalized by time and emissions and categorized by wind speed
+
+@figure_spec
+@instrumented
+def fig_vg_time_emis_ws(df, periods_list,gas, yerr = None):
+    return grouped_bars(df['VG_EM'], periods_list, 'ws', VG_EM_LABEL, 65, ylim = (0,32), lines = VG_TIME_LINES, yerr = yerr)
+
+
+# vertical gradient normalized by time and emissions and categorized by turbulent kinetic energy
+
+@figure_spec
+@instrumented
+def fig_vg_time_emis_tke(df, periods_list,gas, yerr = None):
+    return grouped_bars(df['VG_EM'], periods_list, 'tke', VG_EM_LABEL, 65, ylim = (0,15), lines = VG_TIME_LINES, yerr = yerr)
+
+
+# boundary layer relative bias categorized by wind speed
+
+@figure_spec
+@instrumented
+def fig_bld_RBias(df, periods_list,gas, yerr = None):
+    return grouped_bars(df, periods_list, 'ws', BLD_RBIAS_LABEL, 65, ylim = (-50,500), lines = BLD_RBIAS_LINES, yerr = yerr)
+
+
+# boundary layer relative bias categorized by turbulent kinetic energy
+
+@figure_spec
+@instrumented
+def fig_bld_RBias_tke(df, periods_list,gas, yerr = None):
+    return grouped_bars(df['R_Error(%)'], periods_list, 'tke', BLD_RBIAS_LABEL, 65, ylim = (-50,500), lines = BLD_RBIAS_LINES, yerr = yerr)
+
+
+# boundary layer bias categorized by wind speed
+
+@figure_spec
+@instrumented
+def fig_bld_Bias(df, periods_list,gas, yerr = None):
+    return grouped_bars(df, periods_list, 'ws', r'BLD bias$_{[time]}$ (m)', 65, yerr = yerr)
+
+
+# enhancement categorized by wind speed (the first category, < 2 m/s, is left out of the x axis)
+
+@figure_spec
+@instrumented
+def fig_xs_ws(df, var, periods_list,gas, yerr = None):
+    ylabel, size, ylim, _ = XS_LABELS.get(var, (None, 95, None, None))
+    return grouped_bars(df, periods_list, 'ws', ylabel, size, ylim = ylim, xlim = (0.45,5.5), yerr = yerr)
+
+
+# enhancement categorized by turbulent kinetic energy
+
+@figure_spec
+@instrumented
+def fig_xs_tke(df, var, periods_list,gas, yerr = None):
+    ylabel, size, _, ylim = XS_LABELS.get(var, (None, 95, None, None))
+    return grouped_bars(df, periods_list, 'tke', ylabel, size, ylim = ylim, yerr = yerr)
+
+
+# enhancement/co2difference categorized by wind speed; df_sem is the SEM by period or a (lower, upper)
+# pair of bootstrap intervals (ci_yerr(ci, 'XS_DIFF', index = None, ...))
+
+@figure_spec
+@instrumented
+def fig_xs_diff(df,df_sem, periods_list,gas):
+
+    n = 2*len(periods_list)
+
+    fig, ax = plt.subplots(figsize=(45, 25)) #DCO2 VS TKE
+    bw = 1/11 #barwidth is the distance from the center divided by the # of sites
+    bw_n = 0
+    i = 0
+    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+
+    df.replace([np.inf, -np.inf], np.nan, inplace=True)
+    ax.bar(df.index, df, 
+            yerr=_bar_yerr(df_sem, None, df.index), ecolor='black',width = bw*11, 
+            error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5, 
+            color = my_colors, hatch = np.where(df.index == '12-4 PM LT','X',None),
+            label = None) #color = site01_color, 
+
+    ax.set_ylabel(r'CO$_2$ xs$_{obs}$/$\mid$CO$_2$diff$\mid$', fontsize=95)
+
+    ax.tick_params(axis = 'y',labelsize = 95)    
+    ax.tick_params(axis = 'x',labelsize=80,rotation = 30)
+    ax.grid(axis='y',alpha = 1)
+    ax.set_ylim(0,20)
+    bw_n = bw_n+bw
+    i = i+1
+    ax.axhline(y = 1, color = 'k', linestyle = '-.', linewidth = 4, label = r'CO$_2$ xs$_{obs}$/$\mid$CO$_2$diff$\mid$ = 1.0')
+    ax.legend(loc = 'upper right',fontsize =55)#,title='Wind speed > 5m/s', title_fontsize = 55)
+
+
+# vertical gradient categorized by wind speed
+
+@figure_spec
+@instrumented
+def fig_vg_time_ws(df, periods_list,gas, yerr = None):
+    ylabel, ylim = {'co2': (r'VG[CO$_2$]$_{[time]}$ (ppm/m)', (-0.78,0.1)),
+                    'ch4': (r'VG[CH$_4$]$_{[time]}$ (ppb/m)', (-5,0.1))}.get(gas, (None, None))
+    return grouped_bars(df['VG'], periods_list, 'ws', ylabel, ylim = ylim, legend_loc = 'best', yerr = yerr)
+
+
+# vertical gradient normalized by ff emissions categorized by wind speed
+
+@figure_spec
+@instrumented
+def fig_VGFF_ws(df, var, periods_list,gas, yerr = None):
+    return grouped_bars(df, periods_list, 'ws', VGFF_LABEL, 75, legend_loc = 'best', yerr = yerr)
+
+# vertical gradient normalized by ff emissions categorized by turbulent kinetic energy
+
+@figure_spec
+@instrumented
+def fig_VGFF_tke(df, var, periods_list,gas, yerr = None):
+    return grouped_bars(df, periods_list, 'tke', VGFF_LABEL, 75, legend_loc = 'best', yerr = yerr)
+
+
+# wind speed model vs obs: one figure per period (plot = True) and the fits of the season
+# (regression_table of WS_OBS vs WRF_WS by PERIOD)
+@figure_spec
+@instrumented
+def ws_mod_ob(df,season, plot = True):
+
+    lg_labels = [ '00:00 - 04:59','05:00 - 08:59','09:00 - 11:59', '12:00 - 16:59',
+                 '17:00 - 20:59','21:00 - 23:59']
+
+    df = df.loc[df['SEASON'] == season]
+    fits = regression_table(df, {'WS': ('WS_OBS', 'WRF_WS')}, 'PERIOD').droplevel('VARIABLE') # periods with data only
+    if not plot:
+        return fits
+
+    for i, key in enumerate(PERIOD_HOURS):
+        fig, ax4 = plt.subplots(figsize=(20, 20)) #PLOT OF VERTICAL GRADIENTS VS BLD CATEGORIES
+
+        group = df.loc[(df['PERIOD'] == key).to_numpy()]
+        xx = group['WS_OBS']
+        yy = group['WRF_WS']
+        ax4.plot(xx,
+                 yy, 'o', color = 'black',
+                 markersize= 20, linewidth=5, label = lg_labels[i])
+
+        # the published figures show r under this label; no fit line for periods without data
+        if key in fits.index:
+            m, b = fits.loc[key, 'SLOPE'], fits.loc[key, 'INTERCEPT']
+            ax4.plot(xx, m*xx + b, "r-", lw=5, label = 'r$^2$ = '+str(round(fits.loc[key, 'R'], 2)))
+        ax4.axline((0, 0), slope=1, linestyle = '-.',lw=3, color = 'black', label = '1:1')
+
+
+        ax4.set_xlabel(r'Observed wind speed (m/s)', fontsize=95)
+        ax4.set_ylabel(r'Modeled wind speed (m/s)', fontsize=95)
+        ax4.set_ylim(-0.1,20)
+        ax4.set_xlim(-0.1,20)
+        ax4.legend(loc = 'best',fontsize =45)
+        ax4.tick_params(axis = 'both',labelsize = 95) 
+
+    return fits
+
+# wind speed residuals
+@figure_spec
+@instrumented
+def fig_ws_bias(df, season): #DATA['WSP']
+    i=0
+    
+    lg_labels = [ '00:00 - 04:59','05:00 - 08:59','09:00 - 11:59', '12:00 - 16:59',
+             '17:00 - 20:59','21:00 - 23:59']
+    
+    for key in [ '0-4 AM LT','5-8 AM LT','9-11 AM LT', '12-4 PM LT', '5-8 PM LT','9-11 PM LT']:
+        fig, ax = plt.subplots(figsize=(20, 20)) #PLOT OF VERTICAL GRADIENTS VS BLD CATEGORIES
+
+        
+        #wind speed < 5 m/s (equivalent to wsp category 0 to 3 as defined at the beginning of the code)
+        temp = df.loc[(df['WS_OBS_CAT']<4)&(df['PERIOD'] == key)&(df['SEASON'] == season)]
+        WSP_l5 = temp['Error'].mean()
+
+        # wind speed >= 5 m/s (equivalent to wsp category >= 4 as defined at the beginning of the code)
+        temp = df.loc[(df['WS_OBS_CAT']>=4)&(df['PERIOD'] == key)&(df['SEASON'] == season)]
+        WSP_g5 = temp['Error'].mean()
+
+
+        
+        xx2 = df.loc[(df['WS_OBS_CAT']<4)&(df['PERIOD'] == key)&(df['SEASON']==season)].index
+        yy2 = df['Error'].loc[(df['WS_OBS_CAT']<4)&(df['PERIOD'] == key) &(df['SEASON']==season)]
+
+        xx1 = df.loc[(df['WS_OBS_CAT']>=4)&(df['PERIOD'] == key)&(df['SEASON']==season)].index
+        yy1 = df['Error'].loc[(df['WS_OBS_CAT']>=4)&(df['PERIOD'] == key) &(df['SEASON']==season)]
+
+        ax.plot(xx1,
+                 yy1, 'o', color = 'black', 
+                 markersize= 20, linewidth=5, label = r'$\geq$ 5 m/s')
+
+        ax.plot(xx2,
+                 yy2, 'o', color = 'black', 
+                 alpha = 0.3, markersize= 20, linewidth=5, label = r'< 5 m/s')
+
+        ax.axhline(y=WSP_g5, color = 'k', linestyle = '-.',
+                    linewidth = 4, label = r'Mean bias ($\geq$ 5m/s) =' +str(WSP_g5.round(1)))
+
+        ax.axhline(y=WSP_l5, color = 'k', linestyle = '-.',alpha =0.3,
+                    linewidth = 4, label = r'Mean bias (< 5m/s) =' +str(WSP_l5.round(1)))
+
+
+
+        ax.set_ylabel(r'Wind speed bias (m/s)', fontsize=95)
+        ax.set_ylim(-6.5,6.5)
+        ax.legend(loc = 'best',fontsize =35, title = lg_labels[i], title_fontsize = 45)
+        ax.tick_params(axis = 'y',labelsize = 95) 
+        ax.tick_params(axis = 'x',labelsize = 55, rotation = 30) 
+        plt.grid(alpha=0.5)
+        i = i+1
+
+    return fig
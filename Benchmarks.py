@@ -0,0 +1,547 @@
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.ticker as mticker
+import Add_Data_Functions as adf
+import Wind_Cities as wc
+
+"""
+Benchmarks for the functions in Add_Data_Functions.py and Wind_Cities.py
+
+Run from this directory, e.g.
+    python Benchmarks.py categories --rows 1000000
+    python Benchmarks.py bars --figures 12
+    python Benchmarks.py scaling --scales 1 10 100 --sites 4 --save baseline.json
+    python Benchmarks.py scaling --scales 1 10 --compare baseline.json
+
+"""
+
+
+# best wall time (s) out of repeat calls
+def best_time(func, repeat = 3):
+
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+
+    return min(times)
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+# categorizers
+
+# previous implementation (baseline commit, copied verbatim): a NaN column and one chained .loc
+# assignment per category
+
+def _legacy_wind_category(df,var):
+    
+    df[var+'_CAT'] = np.nan
+    
+    df[var+'_CAT'].loc[(df[var] <2)] = 0 #'<2'
+    df[var+'_CAT'].loc[(df[var] >=2)&(df[var] <3)] = 1# '2-3'
+    df[var+'_CAT'].loc[(df[var] >=3)&(df[var] <4)] = 2#'3-4'
+    df[var+'_CAT'].loc[(df[var] >=4)&(df[var] <5)] = 3#'4-5'
+    df[var+'_CAT'].loc[(df[var] >=5)&(df[var] <6)] = 4#'5-6'
+    df[var+'_CAT'].loc[(df[var] >=6)] = 5#'>=6'
+    
+    
+    return np.array(df[var+'_CAT'])
+
+
+def _legacy_abl_category(df,var):
+
+    df[var+'_CAT'] = np.nan
+
+    df[var+'_CAT'].loc[(df[var] <50)] = 0 
+    df[var+'_CAT'].loc[(df[var] >=50)&(df[var] <200)] = 1
+    df[var+'_CAT'].loc[(df[var] >=200)&(df[var] <350)] = 2
+    df[var+'_CAT'].loc[(df[var] >=350)&(df[var] <500)] = 3
+    df[var+'_CAT'].loc[(df[var] >=500)] = 4
+
+    return np.array(df[var+'_CAT'])
+
+
+
+def _legacy_tke_category(df,var):
+
+    df[var+'_CAT'] = np.nan
+
+    df[var+'_CAT'].loc[(df[var] <1)] = 0 
+    df[var+'_CAT'].loc[(df[var] >=1)&(df[var] <1.2)] = 1
+    df[var+'_CAT'].loc[(df[var] >=1.2)&(df[var] <1.4)] = 2
+    df[var+'_CAT'].loc[(df[var] >=1.4)&(df[var] <1.6)] = 3
+    df[var+'_CAT'].loc[(df[var] >=1.6)] = 4
+
+    return np.array(df[var+'_CAT'])
+
+
+LEGACY_CATEGORIES = {'wind': _legacy_wind_category, 'abl': _legacy_abl_category, 'tke': _legacy_tke_category}
+
+
+def bench_categories(rows = 1000000, repeat = 3, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    samples = {'wind': rng.gamma(2.0, 2.0, rows),
+               'abl': rng.gamma(2.0, 300.0, rows),
+               'tke': rng.gamma(4.0, 0.3, rows)}
+    functions = {'wind': adf.wind_category, 'abl': adf.abl_category, 'tke': adf.tke_category}
+
+    results = pd.DataFrame(index = list(samples), columns = ['ROWS','CHAINED .LOC (s)','BINNED (s)','SPEEDUP'])
+    for name, values in samples.items():
+        values[rng.random(rows) < 0.05] = np.nan # gaps, as in the hourly files
+        df = pd.DataFrame({'VAR': values})
+
+        expected = LEGACY_CATEGORIES[name](df.copy(), 'VAR')
+        np.testing.assert_array_equal(functions[name](df, 'VAR'), expected)
+
+        t_legacy = best_time(lambda: LEGACY_CATEGORIES[name](df.copy(), 'VAR'), repeat)
+        t_binned = best_time(lambda: functions[name](df, 'VAR'), repeat)
+        results.loc[name] = [rows, round(t_legacy, 4), round(t_binned, 4), round(t_legacy/t_binned, 1)]
+
+    return results
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+# grouped bar figures
+
+# previous implementation of the grouped bar figures (fig_vg_norm_time_ws): axes reset once per period
+def _loop_bars(df, periods_list, gas):
+    fig, ax = plt.subplots(figsize=(35, 20))
+    bw = 1/7.5
+    bw_n = 0
+    i = 0
+    x = ['','<2','2-3','3-4','4-5','5-6','>6','']
+    my_colors = ['#377eb8','#4daf4a','#ff7f00','#f7f7f7','#ffff33','#984ea3']
+
+    for period in periods_list:
+        hatch_period = 'X' if period == '12-4 PM LT' else None
+        ax.bar(df['VG'][period].index+bw_n-0.3, df['VG'][period],
+                yerr=0, ecolor='black',width = bw,
+                error_kw=dict(lw=8, capsize=(100*bw), capthick=3), edgecolor='black', linewidth=5,
+                alpha = 1, color = my_colors[i], hatch = hatch_period,
+                label = period )
+        ax.set_xlabel('Wind Speed (m/s)', fontsize=95)
+        ax.set_ylabel(r'$\widetilde{VG}[$CO$_2$]$_{[time]}$', fontsize=95)
+        ax.set_ylim(0,32)
+        ticks_loc = ax.get_xticks().tolist()
+        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
+        ax.set_xticklabels(x)
+        ax.tick_params(axis = 'both',labelsize = 95)
+        ax.grid(axis = 'y',alpha = 1)
+        bw_n = bw_n+bw
+        i += 1
+
+    ax.axhline(y = 2.5, color = 'r', linestyle = '-.', linewidth = 4, label = '2.5x afternoon')
+    ax.axhline(y = 1, color = 'k', linestyle = '-.', linewidth = 4, label = '1.0x afternoon')
+    ax.legend(loc = 'upper right',fontsize =45, title = 'Local time (LT)', title_fontsize = 45)
+    return ax
+
+
+# build and save the figures (png, dpi) of random normalized vertical gradients
+def _save_bars(func, frames, dpi):
+
+    for df in frames:
+        ax = func(df, list(adf.PERIOD_HOURS), 'co2')
+        ax.figure.savefig(io.BytesIO(), format = 'png', dpi = dpi)
+        plt.close(ax.figure)
+
+
+def bench_bars(figures = 12, repeat = 3, seed = 0, dpi = 30):
+
+    rng = np.random.default_rng(seed)
+    periods = list(adf.PERIOD_HOURS)
+    frames = [pd.concat({'VG': pd.DataFrame(rng.random((6, len(periods)))*10, columns = periods)}, axis = 1)
+              for i in range(figures)]
+
+    results = pd.DataFrame(index = ['build', 'build + save'], columns = ['FIGURES','LOOP (s)','GROUPED (s)','SPEEDUP'])
+    for stage, save in (('build', False), ('build + save', True)):
+        if save:
+            t_loop = best_time(lambda: _save_bars(_loop_bars, frames, dpi), repeat)
+            t_grouped = best_time(lambda: _save_bars(adf.fig_vg_norm_time_ws, frames, dpi), repeat)
+        else:
+            t_loop = best_time(lambda: [plt.close(_loop_bars(df, periods, 'co2').figure) for df in frames], repeat)
+            t_grouped = best_time(lambda: [plt.close(adf.fig_vg_norm_time_ws(df, periods, 'co2').figure) for df in frames], repeat)
+        results.loc[stage] = [figures, round(t_loop, 3), round(t_grouped, 3), round(t_loop/t_grouped, 1)]
+
+    return results
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+# synthetic data at scale
+# Files in the formats of DATA_SAMPLE (tower .txt with -9999 fills, METAR csv with null gaps in mph,
+# WRF csv, 20-min TKE csv, airport csv). Scale 1 is one year of hourly data per file, as in the sample;
+# scale 10 and 100 continue the series over 10 and 100 years. sites gives the number of towers
+# (two inlets each) and of airports (at most the airports of Stations.csv).
+
+SAMPLE_HOURS = 8784 # 2016, one year of hourly data
+SYNTHETIC_START = '2016-01-01'
+TOWER_HEADER = ['time','Date','co2','std_dev','n','uncertainty','lat','lon','elevation','inlet_height']
+MODEL_HEADER = ['Date','VWRF','UWRF','WRF_WS']
+TKE_HEADER = ['Date','tke']
+TOWER_HEIGHTS = [10, 40]
+
+
+def _hours(scale, freq = '60min', offset = '0min'):
+
+    periods = int(scale*SAMPLE_HOURS*pd.Timedelta('60min')/pd.Timedelta(freq))
+    return pd.date_range(SYNTHETIC_START, periods = periods, freq = freq) + pd.Timedelta(offset)
+
+
+# daily cycle plus noise, values above floor
+def _series(rng, n, mean, amplitude, noise, floor = 0.0, hours = None):
+
+    phase = 2*np.pi*np.asarray(np.arange(n) % 24 if hours is None else hours)/24
+    return np.maximum(mean + amplitude*np.sin(phase) + noise*rng.standard_normal(n), floor)
+
+
+def synthetic_tower(path, scale = 1, height = 10, seed = 0, gas_fill = 0.005, uncertainty_fill = 0.07):
+
+    rng = np.random.default_rng(seed)
+    times = _hours(scale)
+    n = len(times)
+    epoch = times.values.astype('datetime64[s]').astype(np.int64)
+    gas = _series(rng, n, 420 - height/10, 15, 6, hours = times.hour).round(2)
+    uncertainty = np.full(n, 0.0209)
+    gas[rng.random(n) < gas_fill] = adf.TRACE_GAS_FILL
+    uncertainty[rng.random(n) < uncertainty_fill] = adf.TRACE_GAS_FILL
+
+    rows = np.empty((n, 10), dtype = object)
+    rows[:, 0] = epoch
+    rows[:, 1] = np.char.add(np.datetime_as_string(times.values.astype('datetime64[s]')), 'Z')
+    rows[:, 2] = gas
+    rows[:, 3] = rng.gamma(2, 0.5, n).round(2)
+    rows[:, 4] = rng.integers(90, 140, n)
+    rows[:, 5] = uncertainty
+    rows[:, 6:] = [39.7978, -86.0183, 267, height]
+    header = '# Number of header lines : 2\n# ' + ', '.join(TOWER_HEADER)
+    np.savetxt(path, rows, fmt = '%d, %s, %s, %s, %d, %s, %s, %s, %d, %d', header = header, comments = '')
+
+
+# hourly METAR at :54, like WSP-OBS.csv (station,valid,drct,sped in mph, null for gaps)
+def synthetic_metar(path, station = 'IND', scale = 1, seed = 0, null_fraction = 0.01):
+
+    rng = np.random.default_rng(seed)
+    times = _hours(scale, offset = '54min')
+    n = len(times)
+    df = pd.DataFrame({'station': station, 'valid': times.strftime('%Y-%m-%d %H:%M'),
+                       'drct': (rng.integers(0, 36, n)*10).astype(float),
+                       'sped': (_series(rng, n, 9, 3, 4, hours = times.hour)).round(2)})
+    df.loc[rng.random(n) < null_fraction, 'drct'] = np.nan
+    df.loc[rng.random(n) < null_fraction/10, 'sped'] = np.nan
+    df.to_csv(path, index = False, na_rep = 'null', float_format = '%.2f')
+
+
+# airport file of read_wsp_cities (station,valid,sped), every 30 min
+def synthetic_airport(path, station, scale = 1, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    times = _hours(scale, freq = '30min')
+    df = pd.DataFrame({'station': station, 'valid': times.strftime('%Y-%m-%d %H:%M'),
+                       'sped': _series(rng, len(times), 9, 3, 4, hours = times.hour).round(2)})
+    df.to_csv(path, index = False, float_format = '%.2f')
+
+
+# modeled wind (WSP-WRF_2016.csv layout)
+def synthetic_wrf(path, scale = 1, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    times = _hours(scale)
+    u = 2 + 2*rng.standard_normal(len(times))
+    v = 2*rng.standard_normal(len(times))
+    df = pd.DataFrame({'VWRF': v, 'UWRF': u, 'WRF_WS': np.hypot(u, v)}, index = times.strftime('%Y-%m-%d %H:%M:%S'))
+    df.to_csv(path)
+
+
+# 20-min turbulent kinetic energy (TKE_SITE02.csv layout)
+def synthetic_tke(path, scale = 1, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    times = _hours(scale, freq = '20min')
+    tke = _series(rng, len(times), 1.2, 0.5, 0.3, hours = times.hour)
+    pd.DataFrame({'utc': times.strftime('%Y-%m-%d %H:%M:%S'), 'tke': tke}).to_csv(path, index = False, float_format = '%.5f')
+
+
+# all files of one synthetic dataset; returns their paths
+def synthetic_dataset(directory, scale = 1, sites = 1, seed = 0):
+
+    os.makedirs(directory, exist_ok = True)
+    paths = {'towers': {}, 'airports': os.path.join(directory, 'AIRPORTS', '*.csv')}
+    os.makedirs(os.path.join(directory, 'AIRPORTS'), exist_ok = True)
+    for i in range(sites):
+        site = 'SITE%02d' % (i+1)
+        paths['towers'][site] = {}
+        for height in TOWER_HEIGHTS:
+            path = os.path.join(directory, 'synthetic_co2_%s_%dM_1_hour.txt' % (site, height))
+            synthetic_tower(path, scale, height, seed + 100*i + height)
+            paths['towers'][site][height] = path
+    # airports need a time zone in Stations.csv, so they take the codes of the registry
+    airports = [code for code in adf.load_stations().index if not code.startswith('SITE')]
+    for i, station in enumerate(airports[:sites]):
+        synthetic_airport(os.path.join(directory, 'AIRPORTS', station + '.csv'), station, scale, seed + 100*i)
+
+    paths['metar'] = os.path.join(directory, 'WSP-OBS.csv')
+    paths['wrf'] = os.path.join(directory, 'WSP-WRF.csv')
+    paths['tke'] = os.path.join(directory, 'TKE.csv')
+    synthetic_metar(paths['metar'], scale = scale, seed = seed)
+    synthetic_wrf(paths['wrf'], scale, seed + 1)
+    synthetic_tke(paths['tke'], scale, seed + 2)
+
+    return paths
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+# scaling of the public functions
+
+# (name, function, inputs) for one dataset; inputs are computed before the function is timed
+def _scaling_cases(paths):
+
+    tower = paths['towers']['SITE01'][TOWER_HEIGHTS[0]]
+
+    weather = adf.read_weather(paths['metar'], None)
+    model = adf.read_model_outputs(paths['wrf'], MODEL_HEADER, None)
+    tke = adf.read_model_outputs(paths['tke'], TKE_HEADER, None)
+    df = weather.join(model['WRF_WS']).join(tke['tke'])
+    df['PERIOD'] = adf.period_cat(df)
+    df['SEASON'] = adf.season_cat(df)
+    df['WS_OBS_CAT'] = adf.wind_category(df, 'WS_OBS')
+    errors = df.copy()
+    adf.errors(errors, 'WRF_WS', 'WS_OBS')
+    key_list, airports = wc.read_wsp_cities(paths['airports'])
+    store = wc.wind_store(airports, key_list)
+
+    # emissions in the periods of the tower's own time zone (LAX: UTC-8, not DEFAULT_TIMEZONE)
+    vg = adf.vertical_gradients({'LAX': paths['towers']['SITE01']}, TOWER_HEADER, 'co2', 2016, site_tz = True)
+    np.testing.assert_array_equal(vg['EMISSIONS'].to_numpy(), adf.emissions(vg))
+
+    def read_cached():
+        return adf.read_trace_gas(tower, TOWER_HEADER, None, 'co2', cache_dir = os.path.join(os.path.dirname(tower), 'cache'))
+    read_cached() # writes the cache
+
+    def wind_by_cities():
+        result = wc.wind_by_cities(key_list, airports)
+        plt.close('all')
+        return result
+
+    return [('read_trace_gas', lambda: adf.read_trace_gas(tower, TOWER_HEADER, None, 'co2', cache = False)),
+            ('read_trace_gas (cached)', read_cached),
+            ('iter_trace_gas', lambda: sum(len(batch['time']) for batch in adf.iter_trace_gas(tower, TOWER_HEADER, 'co2'))),
+            ('read_weather', lambda: adf.read_weather(paths['metar'], None)),
+            ('read_model_outputs', lambda: adf.read_model_outputs(paths['wrf'], MODEL_HEADER, None)),
+            ('read_model_outputs (TKE 20-min)', lambda: adf.read_model_outputs(paths['tke'], TKE_HEADER, None)),
+            ('wind_category', lambda: adf.wind_category(df, 'WS_OBS')),
+            ('tke_category', lambda: adf.tke_category(df, 'tke')),
+            ('period_cat', lambda: adf.period_cat(df)),
+            ('season_cat', lambda: adf.season_cat(df)),
+            ('emissions', lambda: adf.emissions(df)),
+            ('errors', lambda: adf.errors(df.copy(), 'WRF_WS', 'WS_OBS')),
+            ('table_mae_bias', lambda: adf.table_mae_bias(errors, 'WS_OBS', 'WRF_WS', list(adf.PERIOD_HOURS))),
+            ('stat_cube', lambda: adf.stat_cube(errors, ['Error', 'ABS_Error', 'WS_OBS'], ['SEASON', 'PERIOD', 'WS_OBS_CAT'])),
+            ('vertical_gradients', lambda: adf.vertical_gradients(paths['towers'], TOWER_HEADER, 'co2', 2016)),
+            ('read_wsp_cities', lambda: wc.read_wsp_cities(paths['airports'])),
+            ('ws_exceedance', lambda: wc.ws_exceedance(store)),
+            ('wind_by_cities', wind_by_cities)]
+
+
+# best time out of repeat calls after a warm-up call (profiling off), then one call with profiling on
+# for rows and peak memory, taken from the record of the benchmarked function (the case name up to ' (')
+def bench_scaling(scales = (1, 10), sites = 1, repeat = 1, seed = 0, directory = None, memory = True):
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            paths = synthetic_dataset(os.path.join(directory or tmp, 'x%d_sites%d' % (scale, sites)), scale, sites, seed)
+            for name, func in _scaling_cases(paths):
+                func() # warm up (lazy imports, first-call caches)
+                seconds = best_time(func, repeat)
+                with adf.profiling(memory = memory) as profile:
+                    func()
+                function = name.split(' (')[0]
+                top = [r for r in profile.records if r['depth'] == 0 and r['function'].rsplit('.', 1)[-1] == function]
+                rows.append({'FUNCTION': name, 'SCALE': scale, 'SITES': sites, 'SECONDS': round(seconds, 4),
+                             'ROWS IN': max([r['rows_in'] for r in top], default = 0),
+                             'ROWS OUT': max([r['rows_out'] for r in top], default = 0),
+                             'PEAK (MB)': round(max([r['peak_mb'] or 0 for r in top], default = 0), 2)})
+
+    return pd.DataFrame(rows).set_index(['FUNCTION', 'SCALE', 'SITES'])
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+# hourly means of METAR archives (stations x years at :54 plus specials): DatetimeIndex + resample
+# over every numeric column (the readers before hourly_means) against integer-epoch bincount on sped
+
+def _resample_station(df):
+
+    df = df.set_index(pd.to_datetime(df['valid'], format = '%Y-%m-%d %H:%M')).tz_localize('UTC')
+    return df.select_dtypes(include = 'number').resample('H').mean()
+
+
+def _binned_station(df):
+
+    return adf.hourly_means(adf.parse_epoch(df['valid'], '%Y-%m-%d %H:%M'), {'sped': df['sped'].to_numpy(dtype = float)})
+
+
+def bench_hourly(stations = 20, years = 5, repeat = 3, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    archives = []
+    for station in range(stations):
+        times = _hours(years, offset = '54min')
+        specials = times[rng.random(len(times)) < 0.1] + pd.Timedelta('20min')
+        times = times.append(specials).sort_values()
+        archives.append(pd.DataFrame({'station': 'S%02d' % station, 'valid': times.strftime('%Y-%m-%d %H:%M'),
+                                      'drct': (rng.integers(0, 36, len(times))*10).astype(float),
+                                      'tmpf': _series(rng, len(times), 50, 10, 5),
+                                      'sped': _series(rng, len(times), 9, 3, 4, hours = times.hour)}))
+    parsed = [df.set_index(pd.to_datetime(df['valid'], format = '%Y-%m-%d %H:%M')).tz_localize('UTC') for df in archives]
+    epochs = [adf.parse_epoch(df['valid'], '%Y-%m-%d %H:%M') for df in archives]
+
+    # same hourly means (the binned grid also runs first to last data hour)
+    legacy, binned = _resample_station(archives[0])['sped'], _binned_station(archives[0])['sped']
+    assert np.allclose(legacy.to_numpy(), binned.to_numpy(), equal_nan = True)
+
+    cases = {'parse + hourly means': (lambda: [_resample_station(df) for df in archives],
+                                      lambda: [_binned_station(df) for df in archives]),
+             'hourly means only': (lambda: [df.select_dtypes(include = 'number').resample('H').mean() for df in parsed],
+                                   lambda: [adf.hourly_means(epoch, {'sped': df['sped'].to_numpy()}) for epoch, df in zip(epochs, archives)])}
+    results = pd.DataFrame(index = list(cases), columns = ['ROWS','RESAMPLE (s)','BINNED (s)','SPEEDUP'])
+    for name, (legacy, binned) in cases.items():
+        t_legacy = best_time(legacy, repeat)
+        t_binned = best_time(binned, repeat)
+        results.loc[name] = [sum(len(df) for df in archives), round(t_legacy, 3), round(t_binned, 3), round(t_legacy/t_binned, 1)]
+
+    return results
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+# import time of the modules in a fresh interpreter (best of repeat) and the optional packages they load
+
+IMPORT_MODULES = ['Add_Data_Functions', 'Wind_Cities', 'Add_Data_Plots']
+HEAVY_MODULES = ['matplotlib', 'sklearn', 'chardet']
+
+def bench_imports(repeat = 3):
+
+    code = ('import sys, time; t = time.perf_counter(); import {module}; seconds = time.perf_counter() - t; '
+            'print(seconds, *[m in sys.modules for m in %r])' % HEAVY_MODULES)
+    results = pd.DataFrame(index = IMPORT_MODULES, columns = ['SECONDS'] + [m.upper() for m in HEAVY_MODULES])
+    for module in IMPORT_MODULES:
+        runs = [subprocess.run([sys.executable, '-c', code.format(module = module)], capture_output = True, text = True, check = True,
+                               cwd = os.path.dirname(os.path.abspath(__file__))).stdout.split() for _ in range(repeat)]
+        results.loc[module] = [round(min(float(run[0]) for run in runs), 3)] + [run == 'True' for run in runs[0][1:]]
+
+    return results
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+# bootstrap intervals of a network: hourly model errors of `sites` sites over one year, cells by
+# (SITE, SEASON, PERIOD, WS_OBS_CAT), means (bias and MAE) and medians
+
+def bench_bootstrap(sites = 50, replicates = 1000, workers = 1, repeat = 1, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    times = _hours(1)
+    frames = []
+    for site in range(sites):
+        ws = _series(rng, len(times), 4, 1.5, 1.5, hours = times.hour)
+        error = 0.3*ws - 1 + rng.standard_normal(len(times))
+        frames.append(pd.DataFrame({'SITE': 'SITE%02d' % site, 'datetime_utc': times, 'WS_OBS': ws,
+                                    'Error': error, 'ABS_Error': np.abs(error)}))
+    df = pd.concat(frames).set_index('datetime_utc')
+    df['PERIOD'] = adf.period_cat(df)
+    df['SEASON'] = adf.season_cat(df)
+    df['WS_OBS_CAT'] = adf.wind_category(df, 'WS_OBS')
+    df = df.set_index('SITE', append = True).swaplevel()
+    by = ['SITE', 'SEASON', 'PERIOD', 'WS_OBS_CAT']
+
+    results = pd.DataFrame(index = ['mean', 'median'], columns = ['ROWS','CELLS','REPLICATES','WORKERS','SECONDS'])
+    for stat in results.index:
+        cells = len(adf.bootstrap_cells(df, 'Error', by, stat, n_boot = 10, strata = 'SEASON'))
+        seconds = best_time(lambda: adf.bootstrap_cells(df, ['Error', 'ABS_Error'], by, stat, n_boot = replicates,
+                                                        strata = 'SEASON', seed = seed, workers = workers), repeat)
+        results.loc[stat] = [len(df), cells, replicates, workers, round(seconds, 2)]
+
+    return results
+
+
+## baselines: results saved as json to compare between commits
+
+def save_baseline(results, path):
+
+    baseline = {'commit': _git_commit(), 'python': platform.python_version(), 'pandas': pd.__version__,
+                'numpy': np.__version__, 'results': results.reset_index().to_dict(orient = 'records')}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent = 1)
+
+
+# SECONDS and PEAK (MB) against a saved baseline; REGRESSION where either grew by more than tolerance
+def compare_baseline(results, path, tolerance = 0.25):
+
+    with open(path) as f:
+        baseline = json.load(f)
+    old = pd.DataFrame(baseline['results']).set_index(['FUNCTION', 'SCALE', 'SITES'])
+
+    both = results.join(old[['SECONDS', 'PEAK (MB)']], rsuffix = ' (BASELINE)', how = 'inner')
+    both['TIME RATIO'] = (both['SECONDS'] / both['SECONDS (BASELINE)']).round(2)
+    both['MEMORY RATIO'] = (both['PEAK (MB)'] / both['PEAK (MB) (BASELINE)'].where(both['PEAK (MB) (BASELINE)'] > 0)).round(2)
+    both['REGRESSION'] = (both['TIME RATIO'] > 1 + tolerance) | (both['MEMORY RATIO'] > 1 + tolerance)
+    both.attrs['baseline commit'] = baseline.get('commit')
+
+    return both
+
+
+def _git_commit():
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+
+BENCHMARKS = {'categories': bench_categories, 'bars': bench_bars, 'scaling': bench_scaling, 'bootstrap': bench_bootstrap, 'imports': bench_imports, 'hourly': bench_hourly}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmarks for Add_Data_Functions and Wind_Cities')
+    parser.add_argument('benchmark', choices = sorted(BENCHMARKS))
+    parser.add_argument('--rows', type = int, help = 'rows of synthetic data (categories)')
+    parser.add_argument('--figures', type = int, help = 'figures per timing (bars)')
+    parser.add_argument('--scales', type = int, nargs = '+', help = 'multiples of the sample size (scaling)')
+    parser.add_argument('--sites', type = int, help = 'towers and airports (scaling), sites (bootstrap)')
+    parser.add_argument('--replicates', type = int, help = 'bootstrap replicates (bootstrap)')
+    parser.add_argument('--workers', type = int, help = 'processes (bootstrap)')
+    parser.add_argument('--stations', type = int, help = 'METAR stations (hourly)')
+    parser.add_argument('--years', type = int, help = 'years of data per station (hourly)')
+    parser.add_argument('--directory', help = 'keep the synthetic files here (scaling)')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--save', metavar = 'JSON', help = 'save the results as a baseline')
+    parser.add_argument('--compare', metavar = 'JSON', help = 'compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'allowed growth before REGRESSION (--compare)')
+    args = parser.parse_args()
+
+    options = {key: value for key, value in vars(args).items()
+               if key not in ['benchmark', 'save', 'compare', 'tolerance'] and value is not None}
+    results = BENCHMARKS[args.benchmark](**options)
+    print(results.to_string())
+
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        comparison = compare_baseline(results, args.compare, args.tolerance)
+        print('\ncompared with', args.compare, '(commit %s)' % comparison.attrs['baseline commit'])
+        print(comparison.to_string())
@@ -0,0 +1,498 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import Add_Data_Functions as adf
+import Wind_Cities as wc
+
+"""
+Batch report: every figure and table of the paper from a config file, without the notebook.
+
+    python Run_Report.py Report_Config.toml --jobs 4
+
+The config is TOML (or YAML, with PyYAML installed); see Report_Config.toml for the keys.
+Relative paths are taken from the directory of the config file. Figures go to <output>/FIGURES
+(one file per format in figure_formats), tables to <output>/TABLES (csv and/or parquet) and the
+time spent in each stage to <output>/timings.csv. With --profile, every call of the public functions
+is recorded (see profiling in Add_Data_Functions.py).
+
+"""
+
+
+DEFAULT_CONFIG = {'output': 'REPORT',
+                  'years': [2016],
+                  'gases': ['co2'],
+                  'seasons': list(adf.SEASON_MONTHS),
+                  'periods': list(adf.PERIOD_HOURS),
+                  'figure_formats': ['png'],
+                  'table_formats': ['csv'],
+                  'dpi': 100,
+                  'tower_header': ['time','Date','{gas}','std_dev','n','uncertainty','lat','lon','elevation','inlet_height'],
+                  'wind_model_header': ['Date','VWRF','UWRF','WRF_WS'],
+                  'abl_header': ['Date','ModelABL','LidarABL'],
+                  'sites': {},
+                  'cities': None,
+                  'align': {},             # {source: {rule = 'mean' | 'nearest' | 'asof', tolerance = seconds}}
+                  'bootstrap': 0,          # day-block bootstrap replicates of the error bars and tables (0: none)
+                  'bootstrap_level': 0.95}
+
+WS_STRONG = 4 # WS_OBS_CAT of 5 m/s and above
+
+
+# config file (toml, or yaml/yml) merged over DEFAULT_CONFIG, paths relative to the config file
+def load_config(path):
+
+    if path.endswith(('.yaml', '.yml')):
+        import yaml
+        with open(path) as f:
+            config = yaml.safe_load(f)
+    else:
+        import tomllib
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+
+    config = dict(DEFAULT_CONFIG, **config)
+    base = os.path.dirname(os.path.abspath(path))
+    config['output'] = os.path.join(base, config['output'])
+    for site in config['sites'].values():
+        site['towers'] = {float(height): os.path.join(base, file) for height, file in site.get('towers', {}).items()}
+        for key in ['wind_obs', 'wind_model', 'tke', 'abl', 'xs']:
+            if site.get(key):
+                site[key] = os.path.join(base, site[key])
+    if config['cities']:
+        config['cities'] = dict(config['cities'], path = os.path.join(base, config['cities']['path']))
+
+    return config
+
+
+# time spent in each stage (s)
+class StageTimer:
+
+    def __init__(self):
+        self.timings = {}
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def summary(self):
+        timings = pd.Series(self.timings, name = 'SECONDS').round(2)
+        timings['total'] = round(sum(self.timings.values()), 2)
+        return timings.to_frame()
+
+
+class _Stage:
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        print('--', self.name, flush = True)
+        self.profile = adf.profile_stage('report: ' + self.name)
+        self.profile.__enter__()
+
+    def __exit__(self, *exc):
+        self.profile.__exit__(*exc)
+        self.timer.timings[self.name] = self.timer.timings.get(self.name, 0) + time.perf_counter() - self.t0
+
+
+# tasks = {key: (function, args)}, run in a process pool when jobs > 1
+def run_tasks(tasks, jobs = 1):
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers = jobs) as pool:
+            futures = {key: pool.submit(func, *args) for key, (func, args) in tasks.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    return {key: func(*args) for key, (func, args) in tasks.items()}
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+### readers
+
+# raw samples of the meteorological inputs, (epoch seconds, {column: values}) at the cadence of each
+# file; hourly_frames puts them on the hours with align_hourly
+
+def _read_wind_obs(path, years):
+
+    epoch, values = adf.read_samples(path, 'valid', ['sped'], adf.time_windows(years), '%Y-%m-%d %H:%M',
+                                     dict(usecols = ['valid', 'sped']))
+    return epoch, {'WS_OBS': values['sped']/2.237} # mph to m/s
+
+
+# WRF wind and ABL files (Date plus the header columns)
+def _read_model(path, header, years):
+
+    return adf.read_samples(path, 'Date', [c for c in header if c != 'Date'], adf.time_windows(years), '%Y-%m-%d %H:%M:%S',
+                            dict(skiprows = 1, names = header))
+
+
+# turbulent kinetic energy, 20-min file (utc, tke)
+def _read_tke(path, years):
+
+    return adf.read_samples(path, 'utc', ['tke'], adf.time_windows(years), '%Y-%m-%d %H:%M:%S')
+
+
+# observed CO2 enhancement (XS), hourly values with day-first dates
+def _read_xs(path, years):
+
+    return adf.read_samples(path, 'time', ['XS'], adf.time_windows(years), '%d/%m/%Y %H:%M', dict(header = 0, names = ['time', 'XS']))
+
+
+def _vertical_gradients(towers, header, gas, years):
+
+    return pd.concat([adf.vertical_gradients(towers, header, gas, year) for year in years])
+
+
+# every input file of every site, read as independent tasks
+def read_inputs(config, jobs = 1):
+
+    years = config['years']
+    tasks = {}
+    for site, files in config['sites'].items():
+        for gas in config['gases']:
+            towers = {height: file.format(gas = gas) for height, file in files['towers'].items()}
+            if towers:
+                header = [h.format(gas = gas) for h in config['tower_header']]
+                tasks[site, 'vg', gas] = (_vertical_gradients, ({site: towers}, header, gas, years))
+        if files.get('wind_obs'):
+            tasks[site, 'wind_obs'] = (_read_wind_obs, (files['wind_obs'], years))
+        if files.get('wind_model'):
+            tasks[site, 'wind_model'] = (_read_model, (files['wind_model'], config['wind_model_header'], years))
+        if files.get('abl'):
+            tasks[site, 'abl'] = (_read_model, (files['abl'], config['abl_header'], years))
+        if files.get('tke'):
+            tasks[site, 'tke'] = (_read_tke, (files['tke'], years))
+        if files.get('xs'):
+            tasks[site, 'xs'] = (_read_xs, (files['xs'], years))
+
+    return run_tasks(tasks, jobs)
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+### hourly frames and aggregates
+
+# (rule, tolerance in seconds) of each meteorological source, see align_hourly
+MET_SOURCES = ['wind_obs', 'wind_model', 'abl', 'tke', 'xs']
+ALIGN = {key: ('mean', None) for key in MET_SOURCES}
+
+def align_rule(config, key):
+
+    rule = config['align'].get(key, {})
+    return (rule.get('rule', ALIGN[key][0]), rule.get('tolerance', ALIGN[key][1]))
+
+
+# one hourly frame per (site, gas): vertical gradients next to the meteorology of the site, aligned
+# on the hours of the years (the grid of vertical_gradients) with the rule of each source
+# (ALIGN, overridden by [align] in the config). VG_FF and XS_FF_BLD divide by EMISSIONS, the relative
+# (dimensionless) emission factors of vertical_gradients, so they are in ppm/m per unit of normalized
+# emissions, not per mol/h; XS_DIFF is dimensionless
+def hourly_frames(config, inputs):
+
+    windows = adf.time_windows(config['years'])
+    frames = {}
+    for site, files in config['sites'].items():
+        sources = {key: inputs[site, key] + align_rule(config, key) for key in MET_SOURCES if (site, key) in inputs}
+        met = adf.align_hourly(sources, windows) if sources else None
+
+        for gas in config['gases']:
+            if (site, 'vg', gas) not in inputs:
+                continue
+            df = inputs[site, 'vg', gas].xs(site, level = 'SITE')
+            if met is not None:
+                df = pd.concat([df, met.drop(columns = [c for c in met.columns if c in df.columns])], axis = 1)
+
+            heights = sorted(files['towers'])
+            df['VG_FF'] = df['VG'] / df['EMISSIONS']
+            if gas != 'co2' and 'XS' in df.columns:
+                df = df.drop(columns = 'XS') # XS is the CO2 enhancement
+            if 'XS' in df.columns:
+                df['XS_DIFF'] = df['XS'] / np.abs(df['VG']*(heights[-1] - heights[0]))
+                if 'LidarABL' in df.columns:
+                    df['XS_FF_BLD'] = df['XS'] / df['EMISSIONS'] / df['LidarABL']
+            if 'WS_OBS' in df.columns:
+                df['WS_OBS_CAT'] = adf.categorize(df['WS_OBS'], adf.CATEGORY_EDGES['wind'])
+            if 'tke' in df.columns:
+                df['TKE_CAT'] = adf.categorize(df['tke'], adf.CATEGORY_EDGES['tke'])
+            df.index = pd.MultiIndex.from_arrays([np.repeat(site, len(df)), df.index], names = ['SITE', 'datetime_utc'])
+            frames[site, gas] = df
+
+    return frames
+
+
+# model - observation errors of one pair of columns (R_Error(%), ABS_Error, Error) on a copy of df
+def _errors(df, model, obs):
+
+    out = df[[c for c in df.columns if c not in ['R_Error(%)', 'ABS_Error', 'Error']]].copy()
+    adf.errors(out, model, obs)
+    return out
+
+
+CUBE_VALUES = ['VG', 'VG_NORM', 'VG_EM', 'VG_FF', 'XS', 'XS_FF_BLD', 'XS_DIFF']
+
+# statistics cubes by (SITE, SEASON, PERIOD, category) for the figures and tables
+def build_cubes(frames):
+
+    cubes = {}
+    for (site, gas), df in frames.items():
+        values = [v for v in CUBE_VALUES if v in df.columns]
+        for cat in ['WS_OBS_CAT', 'TKE_CAT']:
+            if cat in df.columns:
+                data = df.loc[df[cat] >= 0]
+                cubes[site, gas, cat] = adf.stat_cube(data, values, ['SITE', 'SEASON', 'PERIOD', cat])
+        if 'XS_DIFF' in df.columns and 'WS_OBS_CAT' in df.columns:
+            cubes[site, gas, 'XS_DIFF_STRONG'] = adf.stat_cube(df.loc[df['WS_OBS_CAT'] >= WS_STRONG], 'XS_DIFF',
+                                                               ['SITE', 'SEASON', 'PERIOD'])
+
+        if gas != list(dict.fromkeys(g for s, g in frames if s == site))[0]:
+            continue # meteorology only once per site
+        if {'WRF_WS', 'WS_OBS'} <= set(df.columns):
+            ws = _errors(df, 'WRF_WS', 'WS_OBS')
+            cubes[site, 'WS'] = adf.stat_cube(ws, ['Error', 'ABS_Error', 'WS_OBS'], ['SITE', 'SEASON', 'PERIOD'])
+        if {'ModelABL', 'LidarABL'} <= set(df.columns):
+            bld = _errors(df, 'ModelABL', 'LidarABL')
+            bld['R_Error(%)'] = bld['R_Error(%)'].replace([np.inf, -np.inf], np.nan)
+            for cat in ['WS_OBS_CAT', 'TKE_CAT']:
+                if cat in bld.columns:
+                    cubes[site, 'BLD', cat] = adf.stat_cube(bld.loc[bld[cat] >= 0], ['Error', 'ABS_Error', 'R_Error(%)', 'LidarABL'],
+                                                            ['SITE', 'SEASON', 'PERIOD', cat])
+
+    return cubes
+
+
+# bootstrap intervals of the cube statistics the figures and tables show (medians of the bars, means
+# of XS_DIFF and of the errors), same keys as build_cubes; days are drawn within seasons
+def build_intervals(config, frames, jobs = 1):
+
+    options = dict(n_boot = config['bootstrap'], level = config['bootstrap_level'], strata = 'SEASON', workers = jobs)
+    intervals = {}
+    for (site, gas), df in frames.items():
+        values = [v for v in CUBE_VALUES if v in df.columns and v != 'XS_DIFF']
+        for cat in ['WS_OBS_CAT', 'TKE_CAT']:
+            if cat in df.columns:
+                intervals[site, gas, cat] = adf.bootstrap_cells(df.loc[df[cat] >= 0], values, ['SITE', 'SEASON', 'PERIOD', cat],
+                                                                'median', **options)
+        if 'XS_DIFF' in df.columns and 'WS_OBS_CAT' in df.columns:
+            intervals[site, gas, 'XS_DIFF_STRONG'] = adf.bootstrap_cells(df.loc[df['WS_OBS_CAT'] >= WS_STRONG], 'XS_DIFF',
+                                                                         ['SITE', 'SEASON', 'PERIOD'], 'mean', **options)
+
+        if gas != list(dict.fromkeys(g for s, g in frames if s == site))[0]:
+            continue # meteorology only once per site
+        if {'WRF_WS', 'WS_OBS'} <= set(df.columns):
+            ws = _errors(df, 'WRF_WS', 'WS_OBS')
+            intervals[site, 'WS'] = adf.bootstrap_cells(ws, ['Error', 'ABS_Error', 'WS_OBS'], ['SITE', 'SEASON', 'PERIOD'],
+                                                        'mean', **options)
+        if {'ModelABL', 'LidarABL'} <= set(df.columns):
+            bld = _errors(df, 'ModelABL', 'LidarABL')
+            bld['R_Error(%)'] = bld['R_Error(%)'].replace([np.inf, -np.inf], np.nan)
+            for cat in ['WS_OBS_CAT', 'TKE_CAT']:
+                if cat in bld.columns:
+                    intervals[site, 'BLD', cat] = adf.bootstrap_cells(bld.loc[bld[cat] >= 0], ['Error', 'R_Error(%)'],
+                                                                      ['SITE', 'SEASON', 'PERIOD', cat], 'median', **options)
+            if 'WS_OBS_CAT' in bld.columns:
+                intervals[site, 'BLD'] = adf.bootstrap_cells(bld.loc[bld['WS_OBS_CAT'] >= 0], ['Error', 'ABS_Error', 'LidarABL'],
+                                                             ['SITE', 'SEASON', 'PERIOD'], 'mean', **options)
+
+    return intervals
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+### tables and figures
+
+# model vs observation pairs of the regression tables
+REGRESSION_PAIRS = {'WS': ('WS_OBS', 'WRF_WS'), 'ABL': ('LidarABL', 'ModelABL')}
+
+# {name: table}: MAE/bias of the modeled wind speed and BLD, model vs observation regressions,
+# statistics cubes, wind exceedance and, with intervals (build_intervals), bootstrap intervals
+def report_tables(config, cubes, ws_greater = None, frames = None, intervals = None):
+
+    tables = {}
+    for key, cube in cubes.items():
+        site = key[0]
+        for season in config['seasons']:
+            if key[1:] == ('WS',):
+                tables['mae_bias_ws_%s_%s' % (site, season)] = adf.table_mae_bias_cube(cube, 'WS_OBS', config['periods'],
+                                                                                      SITE = site, SEASON = season)
+            if key[1:] == ('BLD', 'WS_OBS_CAT'):
+                tables['mae_bias_bld_%s_%s' % (site, season)] = adf.table_mae_bias_cube(cube, 'LidarABL', config['periods'],
+                                                                                       SITE = site, SEASON = season)
+        flat = cube.copy()
+        flat.columns = [var + '_' + stat for var, stat in cube.columns]
+        tables['cube_' + '_'.join(key)] = flat.reset_index()
+
+    for site in config['sites']:
+        df = next((df for (s, gas), df in (frames or {}).items() if s == site), None)
+        pairs = {var: pair for var, pair in REGRESSION_PAIRS.items() if df is not None and set(pair) <= set(df.columns)}
+        if pairs:
+            tables['regression_' + site] = adf.regression_table(df, pairs, ['SITE', 'SEASON', 'PERIOD']).reset_index()
+
+    for key, ci in (intervals or {}).items():
+        site = key[0]
+        if key[1:] in (('WS',), ('BLD',)):
+            for season in config['seasons']:
+                var_obs = 'WS_OBS' if key[1] == 'WS' else 'LidarABL'
+                tables['mae_bias_ci_%s_%s_%s' % (key[1].lower(), site, season)] = adf.table_mae_bias_ci(ci, var_obs, config['periods'],
+                                                                                                       SITE = site, SEASON = season)
+        tables['ci_' + '_'.join(key)] = ci.reset_index()
+
+    if ws_greater is not None:
+        tables['ws_exceedance'] = ws_greater.reset_index()
+
+    return tables
+
+
+def write_tables(tables, outdir, formats):
+
+    os.makedirs(outdir, exist_ok = True)
+    for name, table in tables.items():
+        table = table.copy()
+        table.columns = [str(c) for c in table.columns]
+        if 'csv' in formats:
+            table.to_csv(os.path.join(outdir, name + '.csv'))
+        if 'parquet' in formats:
+            # row labels (e.g. PERIOD) go into columns; only a default RangeIndex is dropped
+            keep_index = not isinstance(table.index, pd.RangeIndex)
+            table.reset_index(drop = not keep_index).to_parquet(os.path.join(outdir, name + '.parquet'))
+
+
+# error bars from the intervals of one build_intervals key (None without them)
+def _yerr(intervals, key, var, stat, index, **fixed):
+
+    return adf.ci_yerr(intervals[key], var, stat, index, **fixed) if key in intervals else None
+
+
+# {file name: FigureSpec} of every figure the inputs allow, with bootstrap error bars when intervals
+# (build_intervals) are given
+def figure_specs(config, cubes, frames, weather = None, ws_greater = None, intervals = None):
+
+    periods = config['periods']
+    intervals = intervals or {}
+    specs = {}
+    for (site, gas), df in frames.items():
+        for season in config['seasons']:
+            name = '%s_%s_%s_' % (site, gas, season)
+            fixed = dict(SITE = site, SEASON = season)
+            for cat, axis in (('WS_OBS_CAT', 'ws'), ('TKE_CAT', 'tke')):
+                if (site, gas, cat) not in cubes:
+                    continue
+                cube = cubes[site, gas, cat]
+                table = lambda var: adf.cube_table(cube, var, 'median', cat, **fixed)
+                yerr = lambda var: _yerr(intervals, (site, gas, cat), var, 'median', cat, **fixed)
+                if axis == 'ws':
+                    specs[name+'vg_norm_time_ws'] = adf.fig_vg_norm_time_ws(table(['VG_NORM']).rename(columns = {'VG_NORM': 'VG'}), periods, gas,
+                                                                            yerr = yerr('VG_NORM'), spec = True)
+                    specs[name+'vg_time_ws'] = adf.fig_vg_time_ws(table(['VG']), periods, gas, yerr = yerr('VG'), spec = True)
+                    specs[name+'vg_time_emis_ws'] = adf.fig_vg_time_emis_ws(table(['VG_EM']), periods, gas, yerr = yerr('VG_EM'), spec = True)
+                    specs[name+'VGFF_ws'] = adf.fig_VGFF_ws(table('VG_FF'), 'VG_FF', periods, gas, yerr = yerr('VG_FF'), spec = True)
+                    for var in ['XS', 'XS_FF_BLD']:
+                        if (var, 'median') in cube.columns:
+                            specs[name+'xs_ws_'+var] = adf.fig_xs_ws(table(var), var, periods, gas, yerr = yerr(var), spec = True)
+                else:
+                    specs[name+'vg_time_tke'] = adf.fig_vg_time_tke(table(['VG_NORM']).rename(columns = {'VG_NORM': 'VG'}), periods, gas,
+                                                                    yerr = yerr('VG_NORM'), spec = True)
+                    specs[name+'vg_time_emis_tke'] = adf.fig_vg_time_emis_tke(table(['VG_EM']), periods, gas, yerr = yerr('VG_EM'), spec = True)
+                    specs[name+'VGFF_tke'] = adf.fig_VGFF_tke(table('VG_FF'), 'VG_FF', periods, gas, yerr = yerr('VG_FF'), spec = True)
+                    for var in ['XS', 'XS_FF_BLD']:
+                        if (var, 'median') in cube.columns:
+                            specs[name+'xs_tke_'+var] = adf.fig_xs_tke(table(var), var, periods, gas, yerr = yerr(var), spec = True)
+
+            if (site, gas, 'XS_DIFF_STRONG') in cubes:
+                cube = cubes[site, gas, 'XS_DIFF_STRONG'].xs(site, level = 'SITE')
+                if season in cube.index.get_level_values('SEASON'):
+                    cube = cube.xs(season, level = 'SEASON').reindex(periods)
+                    error = _yerr(intervals, (site, gas, 'XS_DIFF_STRONG'), 'XS_DIFF', 'mean', None, **fixed)
+                    specs[name+'xs_diff'] = adf.fig_xs_diff(cube['XS_DIFF', 'mean'], cube['XS_DIFF', 'sem'] if error is None else error,
+                                                            periods, gas, spec = True)
+
+    for site in config['sites']:
+        df = next((df for (s, g), df in frames.items() if s == site), None)
+        for season in config['seasons']:
+            name = '%s_%s_' % (site, season)
+            fixed = dict(SITE = site, SEASON = season)
+            yerr = lambda var, cat = 'WS_OBS_CAT': _yerr(intervals, (site, 'BLD', cat), var, 'median', cat, **fixed)
+            if (site, 'BLD', 'WS_OBS_CAT') in cubes:
+                cube = cubes[site, 'BLD', 'WS_OBS_CAT']
+                specs[name+'bld_RBias'] = adf.fig_bld_RBias(adf.cube_table(cube, 'R_Error(%)', 'median', **fixed), periods, None,
+                                                            yerr = yerr('R_Error(%)'), spec = True)
+                specs[name+'bld_Bias'] = adf.fig_bld_Bias(adf.cube_table(cube, 'Error', 'median', **fixed), periods, None,
+                                                          yerr = yerr('Error'), spec = True)
+            if (site, 'BLD', 'TKE_CAT') in cubes:
+                cube = cubes[site, 'BLD', 'TKE_CAT']
+                specs[name+'bld_RBias_tke'] = adf.fig_bld_RBias_tke(adf.cube_table(cube, ['R_Error(%)'], 'median', 'TKE_CAT', **fixed),
+                                                                    periods, None, yerr = yerr('R_Error(%)', 'TKE_CAT'), spec = True)
+            if df is not None and {'WRF_WS', 'WS_OBS'} <= set(df.columns):
+                ws = _errors(df, 'WRF_WS', 'WS_OBS').droplevel('SITE')
+                ws = ws[['WS_OBS', 'WRF_WS', 'WS_OBS_CAT', 'Error', 'PERIOD', 'SEASON']]
+                specs[name+'ws_mod_ob'] = adf.ws_mod_ob(ws, season, spec = True)
+                specs[name+'ws_bias'] = adf.fig_ws_bias(ws, season, spec = True)
+
+    if weather is not None:
+        for key in sorted(weather):
+            specs['wind_' + key] = wc.wind_by_cities([key], {key: weather[key]}, spec = True)
+    if ws_greater is not None:
+        specs['wind_all_cities'] = wc.all_cities(ws_greater, spec = True)
+
+    return specs
+
+
+#--------------------------------------------------------------------------------------------------------------------------
+
+def run_report(config, jobs = 1, force = False):
+
+    timer = StageTimer()
+    weather = ws_greater = None
+
+    with timer.stage('read'):
+        inputs = read_inputs(config, jobs)
+    if config['cities']:
+        with timer.stage('read cities'):
+            key_list, weather = wc.read_wsp_cities(config['cities']['path'], workers = jobs)
+        with timer.stage('wind exceedance'):
+            ws_greater = wc.ws_exceedance(wc.wind_store(weather, key_list))
+    with timer.stage('hourly frames'):
+        frames = hourly_frames(config, inputs)
+    with timer.stage('aggregate'):
+        cubes = build_cubes(frames)
+    intervals = None
+    if config['bootstrap']:
+        with timer.stage('bootstrap'):
+            intervals = build_intervals(config, frames, jobs)
+    with timer.stage('tables'):
+        write_tables(report_tables(config, cubes, ws_greater, frames, intervals), os.path.join(config['output'], 'TABLES'),
+                     config['table_formats'])
+    with timer.stage('figures'):
+        specs = figure_specs(config, cubes, frames, weather, ws_greater, intervals)
+        for fmt in config['figure_formats']:
+            adf.render_figures(specs, os.path.join(config['output'], 'FIGURES'), workers = jobs, fmt = fmt,
+                               dpi = config['dpi'], force = force)
+
+    summary = timer.summary()
+    summary.to_csv(os.path.join(config['output'], 'timings.csv'))
+    return summary
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Figures and tables of the paper from a config file')
+    parser.add_argument('config', help = 'TOML or YAML config (see Report_Config.toml)')
+    parser.add_argument('--jobs', type = int, default = 1, help = 'processes for reading and rendering')
+    parser.add_argument('--force', action = 'store_true', help = 'render figures even if their data are unchanged')
+    parser.add_argument('--profile', metavar = 'JSONL', help = 'record every function call (time, rows, memory) to this file '
+                                                              'and save a summary to <output>/profile_summary.csv')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'with --profile, do not trace memory (faster)')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.profile:
+        with adf.profiling(args.profile, memory = not args.no_memory) as profile:
+            summary = run_report(config, jobs = args.jobs, force = args.force)
+        profile.summary().to_csv(os.path.join(config['output'], 'profile_summary.csv'))
+        print(profile.summary().head(25).to_string())
+    else:
+        summary = run_report(config, jobs = args.jobs, force = args.force)
+    print(summary.to_string())
@@ -1,18 +1,20 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import time
-import matplotlib.dates as mdates
-import chardet
 import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from datetime import datetime, timedelta
-import matplotlib.ticker as mticker
 import warnings
+from Add_Data_Functions import (PERIOD_HOURS, build_store, figure_spec, hourly_means, instrumented, load_stations, parse_epoch,
+                                profile_stage, site_timezone, station_city)
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 """
 This is a python script with functions used for the
 Monteiro, et al., 2024 -- FIGURES 8 AND 9 (WIND FOR DIFFERENT CITIES)
+(matplotlib and chardet are imported in the functions that need them, so reading the stations and
+the exceedance tables load without them)
 
 This code was written by Vanessa Monteiro.
 
@@ -21,164 +23,81 @@ Last update 04 June 2024
 """
 
 # READ WIND SPEED FROM ALL CITIES 
-def read_wsp_cities(path):
-
-    weather = {}
-    for file in glob.glob(path):
-        with open(file, 'rb') as f:
-            result = chardet.detect(f.read())  # or readline if the file is large
-
-        df = pd.read_csv(file, comment = "#", encoding=result['encoding'])
-        key = df['station'][0]
-        df.index = pd.to_datetime(df['valid'], format = '%Y-%m-%d %H:%M')
-        df = df.tz_localize(tz = 'UTC')
-        df = pd.DataFrame(df.resample('H').mean())
-        df['sped_ms'] = df['sped']/2.237  #it is in mph, so divide the speed value by 2.237 to m/s
-        
-        weather[key] = df
+# workers > 1 reads the stations in a process pool (results keep the sorted file order).
+# Encodings come from Stations.csv, or from encodings = {file name without extension: encoding};
+# stations with neither are detected from the first ENCODING_PREFIX_BYTES of the file.
 
-    key_list = list(weather.keys())
-    
-    return key_list, weather
+ENCODING_PREFIX_BYTES = 65536
+WSP_COLUMNS = ['station', 'valid', 'sped']
 
-##  Plot figures for each city
+@instrumented
+def read_wsp_cities(path, workers = 1, encodings = None):
 
-def wind_by_cities(key_list,weather):
-    
-    
-    # will convert to LOCAL TIME
-    for key in key_list:
-    
-        if key == 'BOS':
-            weather[key].index = weather[key].index.tz_convert('America/New_York')
+    files = sorted(glob.glob(path))
+    encodings = dict(load_stations()['encoding'].dropna(), **(encodings or {}))
+    file_encodings = [encodings.get(os.path.splitext(os.path.basename(file))[0]) for file in files]
 
-        if key == 'BWI':
-            weather[key].index = weather[key].index.tz_convert('America/New_York')
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            stations = list(pool.map(_read_wsp_station, files, file_encodings))
+    else:
+        stations = [_read_wsp_station(file, encoding) for file, encoding in zip(files, file_encodings)]
 
-        if key == 'CYYZ':
-            weather[key].index = weather[key].index.tz_convert('America/Toronto')
+    weather = dict(stations)
+    key_list = list(weather.keys())
+    
+    return key_list, weather
 
-        if key == 'EDDM':
-            weather[key].index = weather[key].index.tz_convert('Europe/Paris')
-        
-        if key == 'EHRD':
-            weather[key].index = weather[key].index.tz_convert('Europe/Paris')
-        
-        if key == 'IAD':
-            weather[key].index = weather[key].index.tz_convert('America/New_York')
 
-        if key == 'LAX':
-            weather[key].index = weather[key].index.tz_convert('America/Los_Angeles')
-            
-        if key == 'LFPG':
-            weather[key].index = weather[key].index.tz_convert('Europe/Paris')
-            
-        if key == 'LSZH':
-            weather[key].index = weather[key].index.tz_convert('Europe/Zurich')
+# one station file: hourly mean wind speed (mph and m/s), from the first to the last hour of the file
+def _read_wsp_station(file, encoding = None):
 
-        if key == 'NZAA':
-            weather[key].index = weather[key].index.tz_convert('Pacific/Auckland')
+    if encoding is None:
+        encoding = _detect_encoding(file, ENCODING_PREFIX_BYTES)
+    with profile_stage('read_wsp_cities: read_csv'):
+        try:
+            df = pd.read_csv(file, comment = "#", encoding=encoding, usecols = WSP_COLUMNS)
+        except UnicodeDecodeError:
+            # the prefix was not representative, detect again from the whole file
+            df = pd.read_csv(file, comment = "#", encoding=_detect_encoding(file, None), usecols = WSP_COLUMNS)
 
-        if key == 'RJAA':
-            weather[key].index = weather[key].index.tz_convert('Asia/Tokyo')
+    key = df['station'][0]
+    with profile_stage('read_wsp_cities: to_datetime'):
+        epoch = parse_epoch(df['valid'], '%Y-%m-%d %H:%M')
+    with profile_stage('read_wsp_cities: hourly means'):
+        df = hourly_means(epoch, {'sped': df['sped'].to_numpy(dtype = float)}, index_name = 'valid')
+    df['sped_ms'] = df['sped']/2.237  #it is in mph, so divide the speed value by 2.237 to m/s
 
-        if key == 'SBGR':
-            weather[key].index = weather[key].index.tz_convert('America/Sao_Paulo')
+    return key, df
 
-        if key == 'SLC':
-            weather[key].index = weather[key].index.tz_convert('America/Denver')
-            
-        if key == 'WIII':
-            weather[key].index = weather[key].index.tz_convert('Asia/Jakarta')
 
-        if key == 'YMML':
-            weather[key].index = weather[key].index.tz_convert('Australia/Melbourne')
+def _detect_encoding(file, n_bytes):
 
-        if key == 'ZBAD':
-            weather[key].index = weather[key].index.tz_convert('Asia/Shanghai')
+    import chardet # only for stations without a known encoding
+    with open(file, 'rb') as f:
+        result = chardet.detect(f.read(n_bytes) if n_bytes else f.read())
 
+    # an ascii prefix says nothing about the rest of the file, utf-8 is the compatible superset
+    if result['encoding'] in (None, 'ascii'):
+        return 'utf-8'
+    return result['encoding']
 
+##  Plot figures for each city
 
-    #%%  ######## CATEGORIZED WIND SPEED
-    for key in key_list:
+@figure_spec
+@instrumented
+def wind_by_cities(key_list,weather):
     
-        # created a dic to store the wind speed by wind cetegory
-        weather[key]['Wind_category'] = np.nan
-
-        weather[key]['Wind_category'].loc[(weather[key]['sped_ms'] <2)] = 0 #'<2'
-        weather[key]['Wind_category'].loc[(weather[key]['sped_ms'] >=2)&(weather[key]['sped_ms'] <3)] = 1# '2-3'
-        weather[key]['Wind_category'].loc[(weather[key]['sped_ms'] >=3)&(weather[key]['sped_ms'] <4)] = 2#'3-4'
-        weather[key]['Wind_category'].loc[(weather[key]['sped_ms'] >=4)&(weather[key]['sped_ms'] <5)] = 3#'4-5'
-        weather[key]['Wind_category'].loc[(weather[key]['sped_ms'] >=5)&(weather[key]['sped_ms'] <6)] = 4#'5-6'
-        weather[key]['Wind_category'].loc[(weather[key]['sped_ms'] >=6)] = 5#'>=6'
-
-
-    ## subset by periods of the day
-    periods = [ '0-4 AM LT','5-8 AM LT','9-11 AM LT', '12-4 PM LT', '5-8 PM LT','9-11 PM LT', '24 Hours']
-    # created a dic to store wind speed subsets by period of the day
-    weather_subset = {}
-
-    for key in key_list:
-        for hours in periods:
-            if hours == '24 Hours':
-                weather_subset[key,hours] = weather[key].copy()
-
-            if hours == '5-8 AM LT':
-                weather_subset[key,hours] = weather[key].loc[((weather[key].index.hour >= 5)&(weather[key].index.hour<=8))].copy()  
-
-            if hours == '9-11 AM LT':
-                weather_subset[key,hours] = weather[key].loc[((weather[key].index.hour >= 9)&(weather[key].index.hour<=11))].copy()
-
-            if hours == '12-4 PM LT':
-                weather_subset[key,hours] = weather[key].loc[((weather[key].index.hour >= 12)&(weather[key].index.hour<=16))].copy()
-
-            if hours == '5-8 PM LT':
-                weather_subset[key,hours] = weather[key].loc[((weather[key].index.hour >= 17)&(weather[key].index.hour<=20))].copy()  
-
-            if hours == '9-11 PM LT':
-                weather_subset[key,hours] = weather[key].loc[((weather[key].index.hour >= 21)&(weather[key].index.hour<=23))].copy() 
-
-            if hours == '0-4 AM LT':
-                weather_subset[key,hours] = weather[key].loc[((weather[key].index.hour >= 0)&(weather[key].index.hour<=4))].copy() 
+    import matplotlib.pyplot as plt
 
+    # all stations in one (SITE, datetime_utc) frame, periods in local time
+    store = wind_store(weather, key_list)
 
 
     #Figures
     
-    # Wind speed list (>= 0, >=2, >=3, so on...)
-    ws_list = ['WS_0','WS_2','WS_3','WS_4','WS_5','WS_6']
-    #threshold list (equivalent to ws_list)
-    th_list = [0,1,2,3,4,5,6]
-
-    # dic to store the wind speed greater than a threshold
-    dic_ws_greater = {}
-
-    for th in th_list:
-        for key in key_list:
-            
-            #N : number of points, P : percentage, MEAN : mean from the subset
-            dic_ws_greater[key,'WS_'+str(th)] = pd.DataFrame(index= periods, columns = ['Name','N','P','MEAN'])
-
-            for hours in periods:
-
-                #%% WIND SPEED AIRPORT VS WRF
-                
-                #subset by threshold
-                weather_subset[key,hours,'WS_'+str(th)] = weather_subset[key,hours].loc[weather_subset[key,hours]['sped_ms']>=th] 
-                y_size_temp = weather_subset[key,'24 Hours'].loc[weather_subset[key,'24 Hours']['sped_ms']>=0] #0
-                # length of the subset
-                y_size = len(y_size_temp[['sped_ms']].dropna())
-                
-
-                y_copy = weather_subset[key,hours,'WS_'+str(th)][['sped_ms']].copy()
-                y_copy = y_copy.dropna()
-                y_pred = y_copy['sped_ms']
-
-
-                dic_ws_greater[key,'WS_'+str(th)].loc[hours]['Name'] = 'WS_'+str(th)
-                dic_ws_greater[key,'WS_'+str(th)].loc[hours]['P'] =  len(y_pred)/y_size
-                dic_ws_greater[key,'WS_'+str(th)].loc[hours]['MEAN'] = weather_subset[key,hours,'WS_'+str(th)]['sped_ms'].mean()
-                dic_ws_greater[key,'WS_'+str(th)].loc[hours]['N'] = len(y_pred)  
+    # N : number of points, P : fraction of the day, MEAN : mean speed, for every threshold and period
+    ws_greater = ws_exceedance(store)
 
     
     ## city by city
@@ -190,21 +109,13 @@ def wind_by_cities(key_list,weather):
 
     for key in key_list:  
     
-        #this is a trick to create the stacked figure // numbers 0 to 6 represent the period of the day. 
-        y0 = [dic_ws_greater[key,'WS_0']['P'][0],dic_ws_greater[key,'WS_1']['P'][0],dic_ws_greater[key,'WS_2']['P'][0],dic_ws_greater[key,'WS_3']['P'][0],
-              dic_ws_greater[key,'WS_4']['P'][0],dic_ws_greater[key,'WS_5']['P'][0],dic_ws_greater[key,'WS_6']['P'][0]]
-        y1 = [dic_ws_greater[key,'WS_0']['P'][1],dic_ws_greater[key,'WS_1']['P'][1],dic_ws_greater[key,'WS_2']['P'][1],dic_ws_greater[key,'WS_3']['P'][1],
-              dic_ws_greater[key,'WS_4']['P'][1],dic_ws_greater[key,'WS_5']['P'][1],dic_ws_greater[key,'WS_6']['P'][1]]
-        y2 = [dic_ws_greater[key,'WS_0']['P'][2],dic_ws_greater[key,'WS_1']['P'][2],dic_ws_greater[key,'WS_2']['P'][2],dic_ws_greater[key,'WS_3']['P'][2],
-              dic_ws_greater[key,'WS_4']['P'][2],dic_ws_greater[key,'WS_5']['P'][2],dic_ws_greater[key,'WS_6']['P'][2]]
-        y3 = [dic_ws_greater[key,'WS_0']['P'][3],dic_ws_greater[key,'WS_0']['P'][3],dic_ws_greater[key,'WS_0']['P'][3],dic_ws_greater[key,'WS_0']['P'][3],
-              dic_ws_greater[key,'WS_0']['P'][3],dic_ws_greater[key,'WS_0']['P'][3],dic_ws_greater[key,'WS_0']['P'][3]]
-        y4 = [dic_ws_greater[key,'WS_0']['P'][4],dic_ws_greater[key,'WS_1']['P'][4],dic_ws_greater[key,'WS_2']['P'][4],dic_ws_greater[key,'WS_3']['P'][4],
-              dic_ws_greater[key,'WS_4']['P'][4],dic_ws_greater[key,'WS_5']['P'][4],dic_ws_greater[key,'WS_6']['P'][4]]
-        y5 = [dic_ws_greater[key,'WS_0']['P'][5],dic_ws_greater[key,'WS_1']['P'][5],dic_ws_greater[key,'WS_2']['P'][5],dic_ws_greater[key,'WS_3']['P'][5],
-              dic_ws_greater[key,'WS_4']['P'][5],dic_ws_greater[key,'WS_5']['P'][5],dic_ws_greater[key,'WS_6']['P'][5]]
-        y6= [dic_ws_greater[key,'WS_0']['P'][6],dic_ws_greater[key,'WS_1']['P'][6],dic_ws_greater[key,'WS_2']['P'][6],dic_ws_greater[key,'WS_3']['P'][6],
-              dic_ws_greater[key,'WS_4']['P'][6],dic_ws_greater[key,'WS_5']['P'][6],dic_ws_greater[key,'WS_6']['P'][6]]
+        # thresholds x periods
+        P = ws_greater.xs(key, level = 'STATION')['P'].unstack('PERIOD')
+
+        # the afternoon is always shown for WS >= 0
+        y0 = list(P['0-4 AM LT']); y1 = list(P['5-8 AM LT']); y2 = list(P['9-11 AM LT'])
+        y3 = [P.loc[0, '12-4 PM LT']]*len(P)
+        y4 = list(P['5-8 PM LT']); y5 = list(P['9-11 PM LT'])
         
         x = [r'$\geq$0',r'$\geq$1',r'$\geq$2',r'$\geq$3',r'$\geq$4', r'$\geq$5',r'$\geq$6']
        
@@ -231,54 +142,152 @@ def wind_by_cities(key_list,weather):
         plt.xticks(rotation= 0,fontsize = 85) 
 
         # label cities
-        if key == 'BOS':
-            city = 'Boston'
-        if key == 'BWI':
-            city = 'Baltimore'
-        if key == 'CYYZ':
-            city = 'Toronto'
-        if key == 'EDDM':
-            city = 'Munich'
-        if key == 'EHRD':
-            city = 'Rotterdam'
-        if key == 'IAD':
-            city = 'Washington DC'
-        if key == 'IND':
-            city = 'Indianapolis'
-        if key == 'LAX':
-            city = 'Los Angeles'
-        if key == 'LFPG':
-            city = 'Paris'
-        if key == 'LSZH':
-            city = 'Zurich'
-        if key == 'NZAA':
-            city = 'Auckland'
-        if key == 'RJAA':
-            city = 'Tokyo'
-        if key == 'SBGR':
-            city = 'Sao Paulo'
-        if key == 'SLC':
-            city = 'Salt Lake City'
-        if key == 'WIII':
-            city = 'Jakarta'
-        if key == 'YMML':
-            city = 'Melbourne'
-        if key == 'ZBAD':
-              city = 'Beijing' 
-        if key == 'LFQA':
-            city = 'Reims'
+        city = station_city(key)
             
         ax.text(.7,.9, city+' ('+key+')', horizontalalignment = 'center',
                fontsize = 105,
                transform=ax.transAxes)
 
 
-    return ax, dic_ws_greater
+    return ax, ws_greater
     
 
+# Exceedance statistics of the hourly wind speed, for every station, period and threshold:
+# N (hours with speed >= threshold), P (N / all valid hours of the day) and MEAN (mean of those speeds).
+# Built on the exceedance curves below. Returns a tidy frame indexed by (STATION, THRESHOLD, PERIOD).
+
+WS_THRESHOLDS = [0, 1, 2, 3, 4, 5, 6]
+PERIODS_24H = list(PERIOD_HOURS) + ['24 Hours']
+
+@instrumented
+def ws_exceedance(store, thresholds = WS_THRESHOLDS, value = 'sped_ms'):
+
+    by_period = ccdf_at(build_ccdf(store, by = ['PERIOD'], value = value), thresholds).reset_index()
+    whole_day = ccdf_at(build_ccdf(store, by = [], value = value), thresholds).reset_index()
+    whole_day['PERIOD'] = '24 Hours'
+    ws_greater = pd.concat([by_period.astype({'PERIOD': str}), whole_day]).set_index(['STATION', 'THRESHOLD', 'PERIOD'])
+
+    # fraction of all valid hours of the day (speed >= 0) of each station
+    day_hours = (store[value] >= 0).groupby(level = 'SITE', sort = False).sum()
+    ws_greater['P'] = ws_greater['N'] / day_hours.reindex(ws_greater.index.get_level_values('STATION')).to_numpy()
+
+    key_list = list(store.index.get_level_values('SITE').unique())
+    index = pd.MultiIndex.from_product([key_list, np.asarray(thresholds, dtype = float), PERIODS_24H],
+                                       names = ['STATION', 'THRESHOLD', 'PERIOD'])
+    ws_greater = ws_greater.reindex(index)
+    ws_greater['N'] = ws_greater['N'].fillna(0).astype(np.int64)
+    ws_greater['P'] = ws_greater['P'].fillna(0)
+
+    return ws_greater[['N', 'P', 'MEAN']]
+
+
+# hourly wind speed (m/s) of all stations in one multi-site store (see build_store), periods in the
+# local time of each city
+@instrumented
+def wind_store(weather, key_list):
+
+    return build_store({key: weather[key] for key in key_list}, categories = {'sped_ms': 'wind'}, columns = ['sped_ms'])
+
+
+# Empirical exceedance curves (CCDF) of the hourly wind speed of each station, split by the local
+# time groups in `by` ('PERIOD', 'MONTH', 'YEAR'). The speeds of all stations are sorted once
+# (grouped), so a curve at any threshold is a searchsorted lookup in its group: O(log n).
+
+@instrumented
+def build_ccdf(store, by = ('PERIOD', 'MONTH'), value = 'sped_ms'):
+
+    by = list(by)
+    speed = store[value].to_numpy(dtype = float)
+    valid = np.isfinite(speed)
+    site_level = store.index.get_level_values('SITE')
+    key_list = list(site_level.unique())
+
+    columns = {'STATION': pd.Categorical(site_level, categories = key_list).codes}
+    if 'PERIOD' in by:
+        columns['PERIOD'] = pd.Categorical(store['PERIOD'], categories = list(PERIOD_HOURS)).codes
+    if 'MONTH' in by or 'YEAR' in by:
+        # local calendar of each station
+        times = store.index.get_level_values('datetime_utc')
+        month, year = np.zeros(len(store), dtype = np.int64), np.zeros(len(store), dtype = np.int64)
+        for i, key in enumerate(key_list):
+            rows = columns['STATION'] == i
+            local = times[rows].tz_convert(site_timezone(key, 'UTC'))
+            month[rows], year[rows] = local.month, local.year
+        if 'MONTH' in by:
+            columns['MONTH'] = month
+        if 'YEAR' in by:
+            columns['YEAR'] = year
+
+    codes = np.column_stack([columns[level][valid].astype(np.int64) for level in columns])
+    speeds = speed[valid]
+
+    # hours outside every period (if any) are left out
+    keep = (codes >= 0).all(axis = 1)
+    codes, speeds = codes[keep], speeds[keep]
+
+    # one integer key per group (mixed radix), groups in sorted order
+    radix = codes.max(axis = 0) + 1 if len(codes) else np.ones(codes.shape[1], dtype = np.int64)
+    weights = np.concatenate([np.cumprod(radix[::-1])[::-1][1:], [1]])
+    group_keys, group_id = np.unique(codes @ weights, return_inverse = True)
+    order = np.lexsort((speeds, group_id))
+    size = np.bincount(group_id, minlength = len(group_keys))
+
+    labels = [(group_keys // weights[j]) % radix[j] for j in range(len(weights))]
+    names = {'STATION': np.asarray(key_list, dtype = object), 'PERIOD': np.asarray(list(PERIOD_HOURS), dtype = object)}
+    labels = [names[level][label] if level in names else label for level, label in zip(columns, labels)]
+
+    return {'groups': pd.MultiIndex.from_arrays(labels, names = list(columns)),
+            'offsets': np.concatenate([[0], np.cumsum(size)]),
+            'speeds': speeds[order],
+            'cumsum': np.concatenate([[0.], np.cumsum(speeds[order])])}
+
+
+# exceedance of one group (e.g. ('IND', '12-4 PM LT', 7)) at one or more thresholds: fraction of hours >= threshold
+@instrumented
+def ccdf_lookup(ccdf, group, threshold):
+
+    group = group if isinstance(group, tuple) else (group,) # 'BOS' for by = [] (SITE only)
+    g = ccdf['groups'].get_indexer([group])[0]
+    if g < 0:
+        raise KeyError(group)
+    start, stop = ccdf['offsets'][g], ccdf['offsets'][g+1]
+    above = stop - start - np.searchsorted(ccdf['speeds'][start:stop], threshold, side = 'left')
+
+    return above / (stop - start)
+
+
+# every group at every threshold: N, CCDF (N / hours in the group) and MEAN of the speeds >= threshold
+@instrumented
+def ccdf_at(ccdf, thresholds):
+
+    thresholds = np.asarray(thresholds, dtype = float)
+    offsets = ccdf['offsets']
+    n_groups = len(offsets) - 1
+
+    N = np.empty((n_groups, len(thresholds)), dtype = np.int64)
+    TOTAL = np.empty((n_groups, len(thresholds)))
+    for g in range(n_groups):
+        start, stop = offsets[g], offsets[g+1]
+        below = start + np.searchsorted(ccdf['speeds'][start:stop], thresholds, side = 'left')
+        N[g] = stop - below
+        TOTAL[g] = ccdf['cumsum'][stop] - ccdf['cumsum'][below]
+
+    size = np.diff(offsets)[:, None]
+    groups = ccdf['groups']
+    index = pd.MultiIndex.from_arrays([np.repeat(groups.get_level_values(level), len(thresholds)) for level in groups.names]
+                                      + [np.tile(thresholds, n_groups)], names = list(groups.names) + ['THRESHOLD'])
+
+    return pd.DataFrame({'N': N.ravel(), 'CCDF': (N / size).ravel(),
+                         'MEAN': np.where(N > 0, TOTAL / np.maximum(N, 1), np.nan).ravel()}, index = index)
+
+
 # summary of all cities  for wind speed greater than 5 m/s only
     
-def all_cities(dic_ws_greater):
+@figure_spec
+@instrumented
+def all_cities(ws_greater):
+
+    import matplotlib.pyplot as plt
 
     ## all cities
     
@@ -287,8 +296,8 @@ def all_cities(dic_ws_greater):
     lg_labels_datafraction = ['12:00-16:59 (WS $\geq$2 m/s)', '00:00-04:59 (WS $\geq$5 m/s)','05:00-08:59 (WS $\geq$5 m/s)',
                               '09:00-11:59 (WS $\geq$5 m/s)', '17:00-20:59 (WS $\geq$5 m/s)','21:00-23:59 (WS $\geq$5 m/s)']
 
-    df2 = pd.DataFrame()
-    df = pd.DataFrame()
+    rows = []
+    rows2 = []
 
 
     key_list_ordered = ['IND','YMML','BOS','NZAA','CYYZ','LFPG','EHRD','SLC','RJAA','IAD','LAX','BWI',
@@ -296,62 +305,29 @@ def all_cities(dic_ws_greater):
 
 
     for key in key_list_ordered:  
-        y0 = [dic_ws_greater[key,'WS_5']['P'][0]]
-        y1 = [dic_ws_greater[key,'WS_5']['P'][1]]
-        y2 = [dic_ws_greater[key,'WS_5']['P'][2]]
-        y3 = [dic_ws_greater[key,'WS_2']['P'][3]]
-        y4 = [dic_ws_greater[key,'WS_5']['P'][4]]
-        y5 = [dic_ws_greater[key,'WS_5']['P'][5]]
-        y6 = [dic_ws_greater[key,'WS_5']['P'][6]]
+        # WS >= 5 m/s, and WS >= 2 m/s for the afternoon
+        P5 = ws_greater.loc[(key, 5), 'P']
+        y0 = [P5['0-4 AM LT']]
+        y1 = [P5['5-8 AM LT']]
+        y2 = [P5['9-11 AM LT']]
+        y3 = [ws_greater.loc[(key, 2, '12-4 PM LT'), 'P']]
+        y4 = [P5['5-8 PM LT']]
+        y5 = [P5['9-11 PM LT']]
         
         #label cities       
-        if key == 'BOS':
-            city = 'Boston'
-        if key == 'BWI':
-            city = 'Baltimore'
-        if key == 'CYYZ':
-            city = 'Toronto'
-        if key == 'EDDM':
-            city = 'Munich'
-        if key == 'EHRD':
-            city = 'Rotterdam'
-        if key == 'IAD':
-            city = 'Washington DC'
-        if key == 'LAX':
-            city = 'Los Angeles'
-        if key == 'LFPG':
-            city = 'Paris'
-        if key == 'LSZH':
-            city = 'Zurich'
-        if key == 'NZAA':
-            city = 'Auckland'
-        if key == 'RJAA':
-            city = 'Tokyo'
-        if key == 'SBGR':
-            city = 'Sao Paulo'
-        if key == 'SLC':
-            city = 'Salt Lake City'
-        if key == 'WIII':
-            city = 'Jakarta'
-        if key == 'YMML':
-            city = 'Melbourne'
-        if key == 'ZBAD':
-              city = 'Beijing'           
-        if key == 'IND':
-            city = 'Indianapolis' 
-        if key == 'LFQA':
-            city = 'Reims'
+        city = station_city(key)
             
         x = [city]
 
         index = pd.Index(x, name='test')
         data = {r'0-4 AM LT': y0,'5-8 AM LT': y1, '9-11 AM LT': y2,
                  '5-8 PM LT': y4, '9-11 PM LT': y5}
-        data1 = pd.DataFrame(data, index=index)
-        df = df.append(data1)
+        rows.append(pd.DataFrame(data, index=index))
         data2 = {r'12-4 PM LT ($\geq$ 2 m/s)': y3}
-        data22 = pd.DataFrame(data2, index=index)
-        df2 = df2.append(data22)
+        rows2.append(pd.DataFrame(data2, index=index))
+
+    df = pd.concat(rows)
+    df2 = pd.concat(rows2)
         
     df['sum'] = np.nan
     df['sum'] = df.sum(axis = 1)